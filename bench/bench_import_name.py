@@ -0,0 +1,46 @@
+"""
+Microbenchmark for `ImportName.of`, comparing the memoized lookup with the
+linear scan over `config.path_info` that it wraps.
+
+Run from the doc-gen root directory with `python3 bench/bench_import_name.py`.
+"""
+import random
+import sys
+import timeit
+from pathlib import Path
+
+# can be removed if we make `print_docs` an installable module
+sys.path.append(str(Path(__file__).parent.parent))
+import print_docs
+from print_docs import ImportName
+
+def main(n_files=4000, n_decls=200000):
+  print_docs.config.path_info = [
+    (Path('/opt/lean/lib/lean/library'), 'core'),
+    (Path('/home/user/mathlib/archive'), 'mathlib-archive'),
+    (Path('/home/user/mathlib/counterexamples'), 'mathlib-counterexamples'),
+    (Path('/home/user/doc-gen/src'), '.'),
+    (Path('/home/user/mathlib/src'), 'mathlib'),
+  ]
+  rng = random.Random(0)
+  files = [f'/home/user/mathlib/src/dir{i % 50}/file{i}.lean' for i in range(n_files)]
+  decl_files = [rng.choice(files) for _ in range(n_decls)]
+
+  def uncached():
+    for f in decl_files:
+      ImportName.of.__wrapped__(ImportName, f)
+
+  def cached():
+    ImportName.of.cache_clear()
+    for f in decl_files:
+      ImportName.of(f)
+
+  assert all(ImportName.of(f) == ImportName.of.__wrapped__(ImportName, f) for f in files)
+  t_uncached = min(timeit.repeat(uncached, number=1, repeat=3))
+  t_cached = min(timeit.repeat(cached, number=1, repeat=3))
+  print(f'ImportName.of, {n_decls} declarations in {n_files} files:')
+  print(f'  linear scan: {t_uncached:.3f}s')
+  print(f'  memoized:    {t_cached:.3f}s ({t_uncached / t_cached:.0f}x faster)')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,63 @@
+"""
+Benchmark for `linkify_efmt` over every efmt tree of the declarations in `export.json`
+(arguments, types, equations, structure fields and constructors), comparing the
+memoized iterative renderer with the recursive one it replaced, and checking that
+both give the same HTML.
+
+Run from a directory containing `export.json` (the output of `lean --run src/entrypoint.lean`),
+e.g. `python3 ../doc-gen/bench/bench_linkify_efmt.py`.
+"""
+import sys
+import time
+import timeit
+from pathlib import Path
+
+# can be removed if we make `print_docs` an installable module
+sys.path.append(str(Path(__file__).parent.parent))
+import print_docs
+
+def linkify_efmt_recursive(f, loc_map):
+  # `linkify_efmt` as it was before it was made iterative
+  def go(f):
+    if isinstance(f, str):
+      f = f.replace('\n', ' ')
+      return print_docs.linkify_linked(f, loc_map)
+    elif f[0] == 'n':
+      return f'<span class="fn">{go(f[1])}</span>'
+    elif f[0] == 'c':
+      return go(f[1]) + go(f[2])
+    else:
+      raise Exception('unknown efmt object')
+
+  return go(['n', f])
+
+def efmts(file_map):
+  for decls in file_map.values():
+    for decl in decls:
+      yield from (arg.arg for arg in decl['args'])
+      yield decl['type']
+      yield from decl['equations']
+      yield from (tp for _, tp in decl['structure_fields'] + decl['constructors'])
+
+def main():
+  print_docs.site_root = '/'
+  start = time.perf_counter()
+  file_map, loc_map, *_ = print_docs.load_json()
+  print(f'load_json (interning efmt trees): {time.perf_counter() - start:.3f}s')
+  trees = list(efmts(file_map))
+
+  def recursive():
+    return [linkify_efmt_recursive(f, loc_map) for f in trees]
+  def memoized():
+    rendered = {}
+    return [print_docs.linkify_efmt(f, loc_map, rendered) for f in trees]
+
+  assert recursive() == memoized()
+  t_recursive = min(timeit.repeat(recursive, number=1, repeat=3))
+  t_memoized = min(timeit.repeat(memoized, number=1, repeat=3))
+  print(f'linkify_efmt, {len(trees)} efmt trees:')
+  print(f'  recursive: {t_recursive:.3f}s')
+  print(f'  memoized:  {t_memoized:.3f}s ({t_recursive / t_memoized:.1f}x faster)')
+
+if __name__ == '__main__':
+  main()
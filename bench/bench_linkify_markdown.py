@@ -0,0 +1,100 @@
+"""
+Benchmark for `linkify_markdown`, comparing it with the five `re.sub` passes
+it was before the passes were precompiled, skipped when they cannot match and
+the linkified code was memoized, and checking that both give the same HTML and
+the same backreferences.
+
+Run from a directory containing `export.json` (the output of `lean --run src/entrypoint.lean`),
+with the mathlib root as the first argument, e.g.
+`python3 ../doc-gen/bench/bench_linkify_markdown.py ../mathlib`.
+"""
+import re
+import sys
+import timeit
+from pathlib import Path
+
+# can be removed if we make `print_docs` an installable module
+sys.path.append(str(Path(__file__).parent.parent))
+import print_docs
+
+def linkify_markdown_five_pass(string: str, loc_map, bib) -> str:
+  # `linkify_markdown` as it was before
+  def linkify_type(string: str):
+    splitstr = re.split(r'([\s\[\]\(\)\{\}])', string)
+    tks = map(lambda s: print_docs.linkify(s, loc_map), splitstr)
+    return "".join(tks)
+
+  def backref(kind: str, counts, prefix: str, key: str) -> str:
+    filename = print_docs.current_filename
+    counts[filename] += 1
+    backref_id = f'{prefix}{counts[filename]}'
+    print_docs.add_backref(kind, key, (filename, backref_id, filename), bib)
+    return backref_id
+
+  def linkify_note(body: str, note: str) -> str:
+    if note in print_docs.global_notes:
+      return f'<a id="{backref("note", print_docs.num_notes, "noteref", note)}" href="{print_docs.site_root}notes.html#{note}">{body}</a>'
+    return body
+  def linkify_named_ref(body: str, name: str, key: str) -> str:
+    if key in bib.entries:
+      alpha_label = bib.entries[key].alpha_label
+      return f'<a id="{backref("bib", print_docs.num_backrefs, "backref", key)}" href="{print_docs.site_root}references.html#{alpha_label}">{name}</a>'
+    return body
+  def linkify_standalone_ref(body: str, key: str) -> str:
+    if key in bib.entries:
+      alpha_label = bib.entries[key].alpha_label
+      return f'<a id="{backref("bib", print_docs.num_backrefs, "backref", key)}" href="{print_docs.site_root}references.html#{alpha_label}">[{alpha_label}]</a>'
+    return body
+
+  string = re.compile(r'Note \[(.*)\]', re.I).sub(
+    lambda p: linkify_note(p.group(0), p.group(1)), string)
+  string = re.sub(r'<code>([^<]+)</code>',
+    lambda p: f'<code>{linkify_type(p.group(1))}</code>', string)
+  string = re.sub(r'<span class="n">([^<]+)</span>',
+    lambda p: f'<span class="n">{linkify_type(p.group(1))}</span>', string)
+  string = re.sub(r'\[([^\]]+)\]\s*\[([^{ },~#%\\]+)\]',
+    lambda p: linkify_named_ref(p.group(0), p.group(1), p.group(2)), string)
+  string = re.sub(r'\[([^{ },~#%\\]+)\]',
+    lambda p: linkify_standalone_ref(p.group(0), p.group(1)), string)
+  return string
+
+def run(linkify_markdown, docs, loc_map, bib):
+  if linkify_markdown is print_docs.linkify_markdown:
+    linked_code = {}
+    linkify_markdown = lambda doc, loc_map, bib: print_docs.linkify_markdown(doc, loc_map, bib, linked_code)
+  # backreferences are collected in `backref_log` rather than in `bib` and `global_notes`
+  print_docs.backref_log = []
+  print_docs.num_notes.clear()
+  print_docs.num_backrefs.clear()
+  html = []
+  for filename, doc in docs:
+    print_docs.current_filename = filename
+    html.append(linkify_markdown(doc, loc_map, bib))
+  return html, print_docs.backref_log
+
+def main(mathlib_root):
+  print_docs.site_root = '/'
+  print_docs.current_project = 'mathlib'
+  bib = print_docs.parse_bib_file(f'{mathlib_root}/docs/references.bib')
+  file_map, loc_map, _, _, notes, mod_docs, _, _, _ = print_docs.load_json()
+  print_docs.global_notes = {name: None for name, _ in notes}
+
+  docs = [(filename.url, doc['doc']) for filename, mdocs in mod_docs.items() for doc in mdocs]
+  docs += [(filename.url, decl['doc_string']) for filename, decls in file_map.items() for decl in decls]
+  docs += [('notes.html', note) for _, note in notes]
+  docs = [(filename, print_docs.markdown_renderer.render_md(doc)) for filename, doc in docs if doc]
+
+  # the backreference titles are only computed by the new implementation
+  old_html, old_backrefs = run(linkify_markdown_five_pass, docs, loc_map, bib)
+  new_html, new_backrefs = run(print_docs.linkify_markdown, docs, loc_map, bib)
+  assert old_html == new_html
+  assert [b[:2] + b[2][:2] for b in old_backrefs] == [b[:2] + b[2][:2] for b in new_backrefs]
+
+  t_old = min(timeit.repeat(lambda: run(linkify_markdown_five_pass, docs, loc_map, bib), number=1, repeat=3))
+  t_new = min(timeit.repeat(lambda: run(print_docs.linkify_markdown, docs, loc_map, bib), number=1, repeat=3))
+  print(f'linkify_markdown, {len(docs)} docstrings, {sum(len(d) for _, d in docs)} characters of HTML:')
+  print(f'  five passes: {t_old:.3f}s')
+  print(f'  now:         {t_new:.3f}s ({t_old / t_new:.1f}x faster)')
+
+if __name__ == '__main__':
+  main(sys.argv[1] if len(sys.argv) > 1 else '.')
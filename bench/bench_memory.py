@@ -0,0 +1,152 @@
+"""
+Memory benchmark for loading a synthetic `export.json` (see `synthetic_export.py`):
+the peak RSS of `load_json`, which keeps each declaration as a compact `Decl` of tuples,
+against loading the declarations as the dicts parsed from `export.json`, as it did before.
+Each loader runs in a process of its own, and both give the same declarations.
+It also reports the peak size of the memo of `linkify_efmt` while the module pages are rendered.
+
+Run from the doc-gen root directory with e.g. `python3 bench/bench_memory.py --modules 3000 --decls 60`,
+which is about the size of mathlib.
+"""
+import argparse
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# can be removed if we make `print_docs` an installable module
+sys.path.append(str(Path(__file__).parent.parent))
+import print_docs
+from print_docs import ImportName
+import synthetic_export
+
+# `print_docs.intern_efmt` as it was before `Decl`, sharing the lists parsed from `export.json`
+def intern_efmt_lists(f, interned):
+  if isinstance(f, str):
+    return interned.setdefault(f, f)
+  nodes = [f]
+  for node in nodes:
+    if not isinstance(node[1], str):
+      nodes.append(node[1])
+    if len(node) > 2 and not isinstance(node[2], str):
+      nodes.append(node[2])
+  canonical = {}
+  for node in reversed(nodes):
+    a = node[1]
+    a = node[1] = interned.setdefault(a, a) if isinstance(a, str) else canonical[id(a)]
+    if len(node) > 2:
+      b = node[2]
+      b = node[2] = interned.setdefault(b, b) if isinstance(b, str) else canonical[id(b)]
+      key = (node[0], id(a), id(b))
+    else:
+      key = (node[0], id(a))
+    canonical[id(node)] = interned.setdefault(key, node)
+  return canonical[id(f)]
+
+def load_dicts():
+  """ `print_docs.load_json` as it was before `Decl`, for the declarations """
+  def intern_decl_efmts(decl, interned):
+    for arg in decl['args']:
+      arg['arg'] = intern_efmt_lists(arg['arg'], interned)
+    decl['type'] = intern_efmt_lists(decl['type'], interned)
+    decl['equations'] = [intern_efmt_lists(eqn, interned) for eqn in decl['equations']]
+    for field in decl['structure_fields'] + decl['constructors']:
+      field[1] = intern_efmt_lists(field[1], interned)
+    decl['filename'] = ImportName.of(decl['filename'])
+    return decl
+
+  interned = {}
+  others = {}
+  with open('export.json', 'r', encoding='utf-8') as f:
+    for key, value in print_docs.stream_export_json(f):
+      if key == 'decls':
+        maps = print_docs.separate_results(intern_decl_efmts(decl, interned) for decl in value)
+      else:
+        others[key] = value
+  return maps
+
+def load_decls():
+  return print_docs.load_json()[:4]
+
+loaders = {'dicts': load_dicts, 'decls': load_decls}
+
+def efmt_memo_peak(file_map, loc_map, max_entries = None):
+  """
+  The most entries and MB that the memo of `linkify_efmt` holds while the efmt trees of the module pages
+  are rendered, when it is dropped before a page once it has more than `max_entries`, as in `write_module_page`
+  """
+  def size(rendered):
+    return sys.getsizeof(rendered) + sum(sys.getsizeof(v) if isinstance(k, str) else sys.getsizeof(k) + sys.getsizeof(v) + sys.getsizeof(v[1])
+      for k, v in rendered.items())
+  rendered = {}
+  peak = (0, 0)
+  for decls in file_map.values():
+    if max_entries is not None and len(rendered) > max_entries:
+      peak = max(peak, (len(rendered), size(rendered)))
+      rendered.clear()
+    for decl in decls:
+      for f in [arg.arg for arg in decl.args] + [decl.type, *decl.equations] + [tp for _, tp in decl.structure_fields + decl.constructors]:
+        print_docs.linkify_efmt(f, loc_map, rendered)
+  entries, size = max(peak, (len(rendered), size(rendered)))
+  return entries, size / 2**20
+
+def measure(loader, directory):
+  """ Runs in a new process: loads `export.json` from `directory` and prints the time and memory taken """
+  os.chdir(directory)
+  print_docs.config.path_info = [(synthetic_export.core_root, 'core'), (synthetic_export.mathlib_root, 'mathlib')]
+  # in KB on Linux
+  rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  start = time.perf_counter()
+  file_map, loc_map, *_ = loaders[loader]()
+  seconds = time.perf_counter() - start
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  decls = [decl for decls in file_map.values() for decl in decls]
+  # a digest of the declarations, to check that both loaders agree
+  def fields(decl):
+    args = [[arg['arg'], arg['implicit']] if isinstance(arg, dict) else list(arg) for arg in decl['args']]
+    return [args] + [decl[key] for key in print_docs.decl_fields if key != 'args']
+  digest = hashlib.sha256(json.dumps([fields(decl) for decl in decls], default=str).encode()).hexdigest()
+  result = {'seconds': seconds, 'peak_mb': rss / 1024, 'loaded_mb': (rss - rss_before) / 1024,
+            'decls': len(decls), 'digest': digest}
+  if loader == 'decls':
+    print_docs.site_root = '/'
+    result['efmt_memo'] = {'shared': efmt_memo_peak(file_map, loc_map),
+                           'bounded': efmt_memo_peak(file_map, loc_map, print_docs.filter_cache_entries['linkify_efmt'])}
+  print(json.dumps(result))
+
+def main():
+  parser = argparse.ArgumentParser('Measure the memory used to load a synthetic export.json')
+  parser.add_argument('--modules', help = 'Number of mathlib modules', type = int, default = 1000)
+  parser.add_argument('--decls', help = 'Average number of declarations per module', type = int, default = 40)
+  parser.add_argument('--seed', type = int, default = 0)
+  parser.add_argument('--measure', help = argparse.SUPPRESS, nargs = 2, metavar = ('LOADER', 'DIR'))
+  args = parser.parse_args()
+  if args.measure:
+    measure(*args.measure)
+    return
+
+  with tempfile.TemporaryDirectory() as tmp:
+    # in another process too, as the peak RSS of a process is inherited by the processes it starts
+    subprocess.run([sys.executable, synthetic_export.__file__, str(Path(tmp) / 'export.json'), '--modules', str(args.modules),
+                    '--decls', str(args.decls), '--seed', str(args.seed)], check = True, stdout = subprocess.DEVNULL)
+    size = (Path(tmp) / 'export.json').stat().st_size
+    results = {}
+    for loader in loaders:
+      out = subprocess.run([sys.executable, __file__, '--measure', loader, tmp], check = True, capture_output = True, text = True).stdout
+      results[loader] = json.loads(out)
+  assert results['dicts']['digest'] == results['decls']['digest']
+  print(f"{results['decls']['decls']} declarations, export.json of {size / 2**20:.0f}MB:")
+  for loader, r in results.items():
+    print(f"  {loader:6} {r['seconds']:6.2f}s, peak RSS {r['peak_mb']:7.1f}MB, of which {r['loaded_mb']:7.1f}MB while loading")
+  print(f"  {results['dicts']['loaded_mb'] / results['decls']['loaded_mb']:.1f}x less memory")
+  print('peak size of the memo of linkify_efmt while rendering the module pages:')
+  for name, (entries, mb) in results['decls']['efmt_memo'].items():
+    print(f"  {name:8} {entries:8} entries, {mb:7.1f}MB")
+
+if __name__ == '__main__':
+  main()
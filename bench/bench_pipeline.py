@@ -0,0 +1,205 @@
+"""
+End-to-end benchmark of the stages of `print_docs.py` on a synthetic `export.json`
+(see `synthetic_export.py`): loading the declarations, rendering efmt trees and
+markdown, writing the module pages, the redirects and the export and search databases.
+
+Each stage is timed `--repeat` times and the fastest run is kept. With `--json` the
+times are saved along with the parameters and the doc-gen commit, so that another
+commit can be compared against them with `--compare`, e.g.
+
+    python3 bench/bench_pipeline.py --json base.json
+    git checkout my-branch
+    python3 bench/bench_pipeline.py --compare base.json
+
+Run from the doc-gen root directory with `python3 bench/bench_pipeline.py`;
+neither `lean` nor `export.json` is needed.
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import networkx as nx
+
+# can be removed if we make `print_docs` an installable module
+sys.path.append(str(Path(__file__).parent.parent))
+import print_docs
+from print_docs import ImportName
+import synthetic_export
+
+bib_source = ''.join(f"""
+@Book{{{key},
+  author = {{Author, {key.title()}}},
+  title = {{{key}}},
+  year = {{19{i}0}}
+}}
+""" for i, key in enumerate(synthetic_export.references))
+
+def synthetic_import_graph(file_map, rng):
+  # each module imports up to three modules that come before it, as `trace_deps` would find
+  graph = nx.DiGraph()
+  modules = list(file_map)
+  for i, module in enumerate(modules):
+    graph.add_node(module)
+    for other in rng.sample(modules[:i], min(i, rng.randint(0, 3))):
+      graph.add_edge(module, other)
+  return graph
+
+def efmts(file_map):
+  for decls in file_map.values():
+    for decl in decls:
+      yield from (arg.arg for arg in decl['args'])
+      yield decl['type']
+      yield from decl['equations']
+      yield from (tp for _, tp in decl['structure_fields'] + decl['constructors'])
+
+def time_stage(repeat, prepare, run):
+  """ The fastest of `repeat` runs of `run(*prepare())`, in seconds; `prepare` is not timed """
+  best = None
+  for _ in range(repeat):
+    args = prepare()
+    start = time.perf_counter()
+    run(*args)
+    t = time.perf_counter() - start
+    best = t if best is None else min(best, t)
+  return best
+
+def fresh_render_caches():
+  # as in a run of `print_docs.py`, code blocks are highlighted and summaries rendered again
+  print_docs.markdown_renderer.highlight_code.cache_clear()
+  print_docs.plaintext_summary.cache_clear()
+  return ()
+
+def fresh_output(tmp):
+  # a new html root, so that no stage skips writing files that are unchanged
+  print_docs.html_root = tempfile.mkdtemp(dir = tmp) + '/'
+  print_docs.output_log = {}
+  fresh_render_caches()
+
+def run_stages(data, bib_file, tmp, repeat):
+  print_docs.site_root = '/'
+  decls_json = json.dumps(data['decls'])
+  stages = {}
+
+  def load(decls):
+    interned = {}
+    return print_docs.separate_results(print_docs.Decl(decl, interned) for decl in decls)
+  stages['separate_results'] = time_stage(repeat, lambda: (json.loads(decls_json),), load)
+  file_map, loc_map, decl_map, owner_map = load(json.loads(decls_json))
+  mod_docs = {ImportName.of(f): docs for f, docs in data['mod_docs'].items()}
+  for i_name in mod_docs:
+    file_map[i_name]
+
+  trees = list(efmts(file_map))
+  def linkify_efmts():
+    rendered = {}
+    for f in trees:
+      print_docs.linkify_efmt(f, loc_map, rendered)
+  stages['linkify_efmt'] = time_stage(repeat, tuple, linkify_efmts)
+
+  docs = [decl['doc_string'] for decls in file_map.values() for decl in decls]
+  docs += [doc['doc'] for mdocs in mod_docs.values() for doc in mdocs]
+  docs += [note for _, note in data['notes']] + [entry['description'] for entry in data['tactic_docs']]
+  docs = [doc for doc in docs if doc]
+  print_docs.markdown_cache = None
+  def convert_markdown():
+    for doc in docs:
+      print_docs.convert_markdown(doc)
+  stages['convert_markdown'] = time_stage(repeat, fresh_render_caches, convert_markdown)
+
+  import_graph = synthetic_import_graph(file_map, random.Random(0))
+  def prepare_module_pages():
+    fresh_output(tmp)
+    bib = print_docs.parse_bib_file(bib_file)
+    print_docs.global_notes = {name: print_docs.GlobalNote(md, []) for name, md in data['notes']}
+    print_docs.num_notes.clear()
+    print_docs.num_backrefs.clear()
+    print_docs.decl_headers.clear()
+    # fresh filter caches, as in a run of `print_docs.py`
+    print_docs.setup_jinja_globals(file_map, loc_map, data['instances'], data['instances_for'], bib, import_graph = import_graph)
+    return (bib,)
+  stages['write_module_pages'] = time_stage(repeat, prepare_module_pages,
+    lambda bib: print_docs.write_module_pages(file_map, mod_docs, bib, jobs = 1))
+
+  def prepare_output():
+    fresh_output(tmp)
+    return ()
+  stages['write_redirects'] = time_stage(repeat, prepare_output, lambda: print_docs.write_redirects(loc_map, decl_map, owner_map))
+  stages['write_find_shards'] = time_stage(repeat, prepare_output, lambda: print_docs.write_find_shards(loc_map, owner_map))
+  # the declaration headers were rendered for the module pages
+  stages['write_export_db'] = time_stage(repeat, prepare_output, lambda: print_docs.write_export_db(print_docs.mk_export_db(file_map)))
+
+  def write_search_db():
+    searchable_data = print_docs.mk_export_searchable_db(file_map, data['tactic_docs'])
+    print_docs.write_export_searchable_db(searchable_data)
+    print_docs.write_search_index(searchable_data)
+  stages['write_search_db'] = time_stage(repeat, prepare_output, write_search_db)
+  return stages
+
+def docgen_commit():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd = Path(__file__).parent).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def print_comparison(base, results):
+  if base['params'] != results['params']:
+    print(f"warning: {base['params']} were used for the base results")
+  print(f"{'stage':20} {'base':>9} {'this':>9} {'ratio':>7}")
+  for stage, t in results['stages'].items():
+    t_base = base['stages'].get(stage)
+    if t_base is None:
+      print(f'{stage:20} {"":>9} {t:8.3f}s')
+    else:
+      print(f'{stage:20} {t_base:8.3f}s {t:8.3f}s {t / t_base:6.2f}x')
+
+def main():
+  parser = argparse.ArgumentParser('Benchmark the stages of print_docs.py on a synthetic export.json')
+  parser.add_argument('--modules', help = 'Number of mathlib modules', type = int, default = 200)
+  parser.add_argument('--decls', help = 'Average number of declarations per module', type = int, default = 30)
+  parser.add_argument('--efmt-depth', help = 'Maximum depth of the efmt tree of a type', type = int, default = 6)
+  parser.add_argument('--doc-paragraphs', help = 'Maximum number of paragraphs in a docstring', type = int, default = 3)
+  parser.add_argument('--seed', type = int, default = 0)
+  parser.add_argument('--repeat', help = 'Number of runs of each stage, of which the fastest is kept', type = int, default = 3)
+  parser.add_argument('--json', help = 'Write the results to a JSON file', metavar = 'FILE')
+  parser.add_argument('--compare', help = 'Compare the results with those written by --json', metavar = 'FILE')
+  args = parser.parse_args()
+
+  params = {'modules': args.modules, 'decls': args.decls, 'efmt_depth': args.efmt_depth,
+            'doc_paragraphs': args.doc_paragraphs, 'seed': args.seed}
+  data = synthetic_export.synthetic_export(**params)
+  # instead of probing `lean` and `leanpkg.toml`
+  print_docs.config.path_info = [(synthetic_export.core_root, 'core'), (synthetic_export.mathlib_root, 'mathlib')]
+  print_docs.config.lean_commit = 'master'
+  print_docs.config.mathlib_github_root = 'https://github.com/leanprover-community/mathlib'
+  ImportName.of.cache_clear()
+
+  with tempfile.TemporaryDirectory() as tmp:
+    bib_file = Path(tmp) / 'references.bib'
+    bib_file.write_text(bib_source)
+    stages = run_stages(data, str(bib_file), tmp, args.repeat)
+
+  results = {
+    'commit': docgen_commit(),
+    'python': platform.python_version(),
+    'params': params,
+    'decls': len(data['decls']),
+    'stages': stages,
+  }
+  print(f"{results['decls']} declarations in {args.modules} modules, fastest of {args.repeat} runs:")
+  for stage, t in stages.items():
+    print(f'  {stage:20} {t:8.3f}s')
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(results, f, indent = 2)
+  if args.compare:
+    with open(args.compare) as f:
+      print_comparison(json.load(f), results)
+
+if __name__ == '__main__':
+  main()
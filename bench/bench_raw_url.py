@@ -0,0 +1,60 @@
+"""
+Regression benchmark for `RawUrl.find` on adversarial texts of growing size,
+comparing it with the regex it replaced, whose lookaheads scanned to the end of
+the text for every URL, and checking that both find the same URLs.
+The time of `RawUrl.find` should grow linearly with the size of the text.
+
+Run from the doc-gen root directory with `python3 bench/bench_raw_url.py`.
+"""
+import re
+import sys
+import timeit
+from pathlib import Path
+
+# can be removed if we make `print_docs` an installable module
+sys.path.append(str(Path(__file__).parent.parent))
+from mistletoe_renderer import RawUrl
+
+# `RawUrl.pattern` as it was before `RawUrl.find` replaced it
+raw_url_regex = re.compile(
+  r'((([A-Za-z]{3,9}:(?:\/\/)?)'  # scheme
+  r'(?:[\-;:&=\+\$,\w]+@)?[A-Za-z0-9\.\-]+(:\[0-9]+)?'  # user@hostname:port
+  r'|(?:www\.|[\-;:&=\+\$,\w]+@)[A-Za-z0-9\.\-]+)'  # www.|user@hostname
+  r'((?:\/[\+~%\/\.\w\-]*)?'  # path
+  r'\??(?:[\-\+=&;%@\.\w]*)'  # query parameters
+  r'#?(?:[\.\!\/\\\w\-]*))?)'  # fragment
+  r'(?![^<]*?(?:<\/\w+>|\/?>))'  # ignore anchor HTML tags
+  r'(?![^\(]*?\))'  # ignore links in brackets (Markdown links and images)
+)
+
+# each makes a text of about `n` characters
+texts = {
+  'prose': lambda n: 'A group, see [the docs](https://example.com/docs), <https://example.com> or https://example.com. ' * (n // 94),
+  'many URLs': lambda n: 'see https://example.com/a?b=c#d and www.example.org ' * (n // 52),
+  'URLs in brackets': lambda n: '(https://example.com/a) ' * (n // 24),
+  'URLs before a tag': lambda n: 'https://example.com ' * (n // 20) + '</a>',
+  'long word': lambda n: 'a' * n,
+  'schemes': lambda n: 'abc:' * (n // 4),
+  'user@ parts': lambda n: 'a@b@' * (n // 4),
+  'closing tag prefix': lambda n: 'http://a.b ' * (n // 22) + '</' + 'a' * (n // 2),
+}
+
+def main(max_regex_seconds=1):
+  print('RawUrl, seconds per text:')
+  for name, make_text in texts.items():
+    t_old = 0
+    for n in [1000, 2000, 4000, 8000, 16000, 32000]:
+      text = make_text(n)
+      new = [m.span() for m in RawUrl.find(text)]
+      t_new = min(timeit.repeat(lambda: RawUrl.find(text), number=1, repeat=3))
+      print(f'  {name:18} {len(text):6} characters, {len(new):4} URLs: find {t_new:.4f}s', end='')
+      # the regex takes cubic time on some of these texts
+      if t_old > max_regex_seconds:
+        print()
+        continue
+      assert [m.span() for m in raw_url_regex.finditer(text)] == new
+      t_old = min(timeit.repeat(lambda: list(raw_url_regex.finditer(text)), number=1, repeat=3))
+      print(f', regex {t_old:.4f}s')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,128 @@
+"""
+Throughput benchmark for `mathjax_editing.remove_math`, comparing it with the
+implementation it replaced, which split the text into a list of blocks, searched
+every block with a regex and joined the math and the stripped text from them,
+and checking that both give the same results.
+
+Run from the doc-gen root directory with `python3 bench/bench_remove_math.py`.
+"""
+import random
+import re
+import sys
+import timeit
+from pathlib import Path
+
+# can be removed if we make `print_docs` an installable module
+sys.path.append(str(Path(__file__).parent.parent))
+from mathjax_editing import remove_math
+import synthetic_export
+
+# `mathjax_editing.SPLIT` and `remove_math` as they were before the split walk was sped up
+split_regex = re.compile(r'(\$\$?|\\(?:begin|end)\{[a-z]*\*?\}|\\[\\{}$]|[{}]|(?:\n\s*)+|@@\d+@@|`+)', re.I)
+
+def remove_math_split(text, inline):
+  def process_math(i, j):
+    nonlocal blocks, start, end, last
+    block = "".join(blocks[i:j+1])
+    if indent:
+      block = re.sub(r'\n    ', '\n', block)
+    while j > i:
+      blocks[j] = ""
+      j -= 1
+    blocks[i] = f"@@{len(math)}@@"
+    math.append(block)
+    start = None
+    end = None
+    last = None
+
+  start = None
+  end = None
+  last = None
+  indent = None
+  braces = None
+  math = []
+  blocks = re.split(split_regex, re.sub(r'\r\n?', "\n", text))
+  i = 1
+  m = len(blocks)
+  while i < m:
+    block = blocks[i]
+    if block[0] == "@":
+      blocks[i] = f"@@{len(math)}@@"
+      math.append(block)
+    elif start:
+      if block == end:
+        if braces > 0:
+          last = i
+        elif braces == 0:
+          process_math(start, i)
+        else:
+          start = None
+          end = None
+          last = None
+      elif re.search(r'\n.*\n', block) or i + 2 >= m:
+        if last:
+          i = last
+          if braces >= 0:
+            process_math(start, i)
+        start = None
+        end = None
+        last = None
+        braces = 0
+      elif block == "{" and braces >= 0:
+        braces += 1
+      elif block == "}" and braces > 0:
+        braces -= 1
+    else:
+      if block == inline or block == "$$":
+        start = i
+        end = block
+        braces = 0
+      elif block[1:6] == "begin":
+        start = i
+        end = "\\end" + block[6:]
+        braces = 0
+      elif block[0] == "`":
+        start = i
+        last = i
+        end = block
+        braces = -1
+      elif block[0] == "\n":
+        if re.search(r'    $', block):
+          indent = True
+    i += 2
+  if last:
+    process_math(start, last)
+  text = "".join(blocks)
+  if not inline.startswith("\\"):
+    text = re.sub(r'\\\$', '\\\\$', text)
+  return (text, math)
+
+def docstrings(n, seed = 0):
+  rng = random.Random(seed)
+  names = [f'mod{i}.decl{j}' for i in range(20) for j in range(20)]
+  return [synthetic_export.docstring(rng, names, 3) for _ in range(n)]
+
+# each is a list of texts of about `n` characters in total
+inputs = {
+  'docstrings': lambda n: docstrings(n // 250),
+  'latex.md': lambda n: [(Path(__file__).parent.parent / 'test' / 'latex.md').read_text()],
+  'one paragraph': lambda n: ['Let $x \\in G$ and $\\{y\\}$, then `x * y` is $$\\sum_i x_i$$ and ' * (n // 64)],
+  'unclosed backticks': lambda n: [' '.join('`' * (i % 60 + 1) for i in range(n // 32)) + ' $x$'],
+  'unbalanced braces': lambda n: ['${ x $ ' * (n // 7) + '\n\n$y$'],
+  'markers': lambda n: ['see @@1@@ and $x$, or $a @@2@@ b$ ' * (n // 32)],
+}
+
+def main(n = 200000):
+  print('remove_math, seconds per input:')
+  for name, make_texts in inputs.items():
+    texts = make_texts(n)
+    for text in texts:
+      assert remove_math(text, '$') == remove_math_split(text, '$')
+    t_new = min(timeit.repeat(lambda: [remove_math(text, '$') for text in texts], number=1, repeat=3))
+    t_old = min(timeit.repeat(lambda: [remove_math_split(text, '$') for text in texts], number=1, repeat=3))
+    size = sum(len(text) for text in texts)
+    print(f'  {name:18} {size:7} characters: remove_math {t_new:.4f}s ({size / t_new / 1e6:5.1f}M characters/s),'
+          f' split {t_old:.4f}s ({t_old / t_new:.1f}x)')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,63 @@
+"""
+Scaling benchmark for `mk_site_tree_core` on synthetic libraries of up to 50k modules,
+comparing the single pass over the filenames with the recursive filtering it replaced,
+and checking that both build the same `site_tree`.
+
+Run from the doc-gen root directory with `python3 bench/bench_site_tree.py`.
+"""
+import random
+import sys
+import timeit
+from pathlib import Path
+
+# can be removed if we make `print_docs` an installable module
+sys.path.append(str(Path(__file__).parent.parent))
+import print_docs
+
+def mk_site_tree_core_filtering(filenames, path=[]):
+  # `mk_site_tree_core` as it was before it was made linear
+  entries = []
+
+  for dirname in sorted(set(dirname for dirname, *rest in filenames if rest != [])):
+    new_path = path + [dirname]
+    entries.append({
+      "kind": "project" if not path else "dir",
+      "name": dirname,
+      "path": '/'.join(new_path[1:]),
+      "children": mk_site_tree_core_filtering([rest for dn, *rest in filenames if rest != [] and dn == dirname], new_path)
+    })
+
+  for filename in sorted(filename for filename, *rest in filenames if rest == []):
+    new_path = path + [filename]
+    entries.append({
+      "kind": "file",
+      "name": filename,
+      "path": '/'.join(new_path[1:]) + '.html',
+    })
+
+  return entries
+
+def synthetic_filenames(n_modules, fan_out, rng):
+  # a library with `fan_out` subdirectories per directory, where some files share a directory's name
+  projects = ['core', 'mathlib', 'mathlib-archive']
+  filenames = set()
+  while len(filenames) < n_modules:
+    depth = rng.randint(1, 5)
+    parts = [f'd{rng.randrange(fan_out)}' for _ in range(depth - 1)]
+    parts.append(f'd{rng.randrange(fan_out)}' if rng.random() < .1 else f'file{rng.randrange(n_modules)}')
+    filenames.add((rng.choice(projects), *parts))
+  return [list(filename) for filename in filenames]
+
+def main():
+  rng = random.Random(0)
+  print('mk_site_tree_core:')
+  for n_modules, fan_out in [(1000, 10), (5000, 20), (10000, 30), (50000, 60)]:
+    filenames = synthetic_filenames(n_modules, fan_out, rng)
+    assert print_docs.mk_site_tree_core(filenames) == mk_site_tree_core_filtering(filenames)
+    t_old = min(timeit.repeat(lambda: mk_site_tree_core_filtering(filenames), number=1, repeat=3))
+    t_new = min(timeit.repeat(lambda: print_docs.mk_site_tree_core(filenames), number=1, repeat=3))
+    print(f'  {n_modules:6} modules, fan-out {fan_out:3}: '
+          f'filtering {t_old:.3f}s, single pass {t_new:.3f}s ({t_old / t_new:.1f}x faster)')
+
+if __name__ == '__main__':
+  main()
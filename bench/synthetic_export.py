@@ -0,0 +1,149 @@
+"""
+Generator for synthetic `export.json` files, shaped like the output of
+`lean --run src/entrypoint.lean` on mathlib: modules in nested directories,
+declarations whose efmt trees link to each other, docstrings with math,
+code spans, code blocks, lists, notes and references, structures with fields,
+inductive types with constructors, instances, library notes and tactic docs.
+
+The filenames are placed under `core_root` and `mathlib_root`, which do not
+need to exist; set `print_docs.config.path_info` to the same directories to
+load the result (see `bench_pipeline.py`).
+
+Run e.g. `python3 bench/synthetic_export.py export.json --modules 3000 --decls 60`.
+"""
+import argparse
+import json
+import random
+from pathlib import Path
+
+# as in `bench_import_name.py`
+core_root = Path('/opt/lean/lib/lean/library')
+mathlib_root = Path('/home/user/mathlib/src')
+
+dirs = ['algebra', 'algebra/group', 'algebra/ring', 'analysis', 'analysis/normed', 'category_theory',
+        'data', 'data/nat', 'data/list', 'data/real', 'linear_algebra', 'measure_theory',
+        'number_theory', 'order', 'order/filter', 'ring_theory', 'set_theory', 'tactic', 'topology']
+words = ['the', 'a', 'of', 'is', 'group', 'ring', 'module', 'map', 'function', 'set', 'finite', 'sum',
+         'product', 'continuous', 'measurable', 'filter', 'order', 'lattice', 'equivalence', 'linear',
+         'natural', 'number', 'where', 'such', 'that', 'for', 'all', 'every', 'given', 'lemma']
+attributes = [[], [], [], ['simp'], ['instance', 'priority 100'], ['ext'], ['norm_cast'], ['simp', 'norm_cast']]
+notes = ['simp lemmas', 'coercion into rings', 'implementation notes', 'forgetful inheritance']
+references = ['bourbaki1966', 'serre1973', 'lang2002', 'atiyah-macdonald']
+
+def sentence(rng, names, n_words):
+  parts = []
+  for _ in range(n_words):
+    r = rng.random()
+    if r < .08:
+      parts.append(f'`{rng.choice(names)}`')
+    elif r < .12:
+      parts.append(f'${rng.choice(["x", "f(x)", "a + b", "G"])} {rng.choice(["=", "≤", "∈"])} {rng.choice(["y", "0", "∑ i, x_i", "H"])}$')
+    elif r < .13:
+      parts.append(f'[{rng.choice(references)}]')
+    else:
+      parts.append(rng.choice(words))
+  return ' '.join(parts).capitalize() + '.'
+
+def docstring(rng, names, paragraphs):
+  blocks = []
+  for _ in range(rng.randint(1, paragraphs)):
+    r = rng.random()
+    if r < .6:
+      blocks.append(' '.join(sentence(rng, names, rng.randint(5, 20)) for _ in range(rng.randint(1, 4))))
+    elif r < .7:
+      blocks.append('$$\\sum_{i = 0}^{n} ' + rng.choice(['x_i', 'f(i)', 'a_i b_i']) + ' = ' + rng.choice(['y', '\\int_0^1 g']) + '$$')
+    elif r < .8:
+      blocks.append('```lean\nexample : ' + rng.choice(names) + ' = ' + rng.choice(names) + ' :=\nby simp\n```')
+    elif r < .9:
+      blocks.append('\n'.join(f'* {sentence(rng, names, rng.randint(3, 8))}' for _ in range(rng.randint(2, 5))))
+    else:
+      blocks.append(f'See Note [{rng.choice(notes)}] and https://en.wikipedia.org/wiki/Group_(mathematics).')
+  return '\n\n'.join(blocks)
+
+def efmt(rng, names, depth):
+  # ['c', a, b] concatenates, ['n', a] nests, and strings are leaves with links to declarations
+  if depth == 0 or rng.random() < .2:
+    r = rng.random()
+    if r < .5:
+      name = rng.choice(names)
+      return f'\ue000{name}\ue001{name.split(".")[-1]}\ue002 '
+    elif r < .6:
+      return '\ue000Type\ue001Type\ue002'
+    return rng.choice([' → ', '(', ')', ' ', ' : ', '{', '}', 'x', 'α', '\n  '])
+  if rng.random() < .3:
+    return ['n', efmt(rng, names, depth - 1)]
+  return ['c', efmt(rng, names, depth - 1), efmt(rng, names, depth - 1)]
+
+def synthetic_export(modules = 500, decls = 40, efmt_depth = 6, doc_paragraphs = 3, seed = 0):
+  rng = random.Random(seed)
+  filenames = [str(core_root / 'init' / f'mod{i}.lean') for i in range(max(1, modules // 50))]
+  filenames += [str(mathlib_root / rng.choice(dirs) / f'mod{i}.lean') for i in range(modules)]
+  # names are generated first, so that efmt trees and docstrings can link to any declaration
+  names_by_file = {f: [f'{Path(f).stem}.{rng.choice(["", "sub.", "foo.bar."])}decl{i}' for i in range(rng.randint(1, 2 * decls))]
+                   for f in filenames}
+  names = [name for file_names in names_by_file.values() for name in file_names] + ['nat', 'list.map']
+
+  export_decls = []
+  for filename, file_names in names_by_file.items():
+    for line, name in enumerate(file_names):
+      kind = rng.choice(['theorem', 'theorem', 'theorem', 'def', 'instance', 'structure', 'inductive'])
+      fields = [[f'{name}.f{i}', efmt(rng, names, efmt_depth // 2)] for i in range(rng.randint(1, 4))] if kind == 'structure' else []
+      ctors = [[f'{name}.c{i}', efmt(rng, names, efmt_depth // 2)] for i in range(rng.randint(1, 4))] if kind == 'inductive' else []
+      export_decls.append({
+        'name': name,
+        'is_meta': rng.random() < .05,
+        'args': [{'arg': efmt(rng, names, efmt_depth // 2), 'implicit': rng.random() < .5} for _ in range(rng.randint(0, 5))],
+        'type': efmt(rng, names, efmt_depth),
+        'doc_string': docstring(rng, names, doc_paragraphs) if rng.random() < .6 else '',
+        'filename': filename,
+        'line': 10 + 12 * line,
+        'attributes': rng.choice(attributes),
+        'noncomputable_reason': None,
+        'sorried': False,
+        'equations': [efmt(rng, names, efmt_depth // 2)] if kind == 'def' and rng.random() < .5 else [],
+        'kind': kind,
+        'structure_fields': fields,
+        'constructors': ctors,
+      })
+  # export.json is not sorted by module
+  rng.shuffle(export_decls)
+
+  classes = [d['name'] for d in export_decls if d['kind'] == 'structure']
+  instances = {c: rng.sample(names, rng.randint(1, 10)) for c in classes[:len(classes) // 2]}
+  instances_for = {c: rng.sample(names, rng.randint(1, 5)) for c in classes[len(classes) // 2:]}
+  instances_for.update({'↥' + c: rng.sample(names, 2) for c in classes[:10]})
+  tactic_docs = [{
+    'name': f'tac{i}',
+    'category': rng.choice(['tactic', 'tactic', 'command', 'hole_command', 'attribute']),
+    'decl_names': rng.sample(names, 2),
+    'tags': rng.sample(['simp', 'arithmetic', 'logic', 'rewriting', 'core'], rng.randint(0, 2)),
+    'description': docstring(rng, names, doc_paragraphs),
+    'import': rng.choice(['', 'tactic.basic']),
+  } for i in range(max(1, modules // 10))]
+
+  return {
+    'decls': export_decls,
+    'mod_docs': {f: [{'line': 1, 'doc': '# ' + Path(f).stem + '\n\n' + docstring(rng, names, 2 * doc_paragraphs)}]
+                 for f in filenames if rng.random() < .8},
+    'notes': [[note, docstring(rng, names, doc_paragraphs)] for note in notes],
+    'tactic_docs': tactic_docs,
+    'instances': instances,
+    'instances_for': instances_for,
+  }
+
+def main():
+  parser = argparse.ArgumentParser('Write a synthetic export.json')
+  parser.add_argument('output', help = 'Path of the export.json to write')
+  parser.add_argument('--modules', help = 'Number of mathlib modules', type = int, default = 500)
+  parser.add_argument('--decls', help = 'Average number of declarations per module', type = int, default = 40)
+  parser.add_argument('--efmt-depth', help = 'Maximum depth of the efmt tree of a type', type = int, default = 6)
+  parser.add_argument('--doc-paragraphs', help = 'Maximum number of paragraphs in a docstring', type = int, default = 3)
+  parser.add_argument('--seed', type = int, default = 0)
+  args = parser.parse_args()
+  data = synthetic_export(args.modules, args.decls, args.efmt_depth, args.doc_paragraphs, args.seed)
+  with open(args.output, 'w', encoding='utf-8') as f:
+    json.dump(data, f)
+  print(f'{args.output}: {len(data["decls"])} declarations in {args.modules} modules')
+
+if __name__ == '__main__':
+  main()
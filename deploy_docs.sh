@@ -30,15 +30,15 @@ if [ "$(cd mathlib_docs && git log -1 --pretty=format:%s)" == "automatic update
   exit 0
 fi
 
-rm -rf mathlib_docs/docs/
-
 # Force doc_gen project to match the Lean version used in CI.
 # If they are incompatible, something in doc_gen will fail to compile,
 # but this is better than trying to recompile all of mathlib.
 elan override set "$lean_version"
 
+# files whose content did not change are not written again, so `git add` can skip them by their mtime,
+# and the files of removed declarations and modules are deleted
 ./gen_docs -w "https://$4.github.io/$5/" \
-  -r "$3/" -t "mathlib_docs/docs/"
+  -r "$3/" -t "mathlib_docs/docs/" --clean
 
 if [ "$6" = "true" ]; then
   cd mathlib_docs/docs
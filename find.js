@@ -0,0 +1,49 @@
+// Resolve find/<decl> and find/<decl>/src URLs on the 404 page,
+// using the table written by `write_find_shards` in print_docs.py.
+
+// must agree with `find_shard_count` in print_docs.py
+const findShardCount = 256;
+
+// must agree with `find_shard` in print_docs.py;
+// `fnv1a` is defined in search.js, which base.j2 loads before this script
+function findShard(declName) {
+  return fnv1a(declName) % findShardCount;
+}
+
+async function findDecl(declName) {
+  const res = await fetch(`${siteRoot}find_shards/${findShard(declName)}.json`);
+  if (!res.ok) return;
+  const {modules, decls} = await res.json();
+  const entry = decls[declName];
+  if (!entry) return;
+  const [pageUrl, srcUrl] = modules[entry[0]];
+  return {
+    docs: `${siteRoot}${pageUrl}#${encodeURIComponent(declName)}`,
+    src: srcUrl ? `${srcUrl}#L${entry[1]}` : `${siteRoot}${pageUrl}`,
+  };
+}
+
+(async () => {
+  const findPath = new URL(`${siteRoot}find/`, window.location).pathname;
+  const path = window.location.pathname;
+  if (!path.startsWith(findPath)) return;
+
+  let declName = decodeURIComponent(path.slice(findPath.length)).replace(/\/$/, '');
+  const src = declName.endsWith('/src');
+  if (src) declName = declName.slice(0, -'/src'.length);
+  if (!declName) return;
+
+  let found;
+  try {
+    found = await findDecl(declName);
+  } catch (e) {
+    return;
+  }
+  if (!found) return;
+  if (src) {
+    // redirectTo is set in add_commit.js
+    redirectTo(found.src);
+  } else {
+    window.location.replace(found.docs);
+  }
+})();
@@ -32,7 +32,9 @@ math and `replace_math` puts the math back in.
 import re
 from typing import Match, List
 
-SPLIT = re.compile(r'(\$\$?|\\(?:begin|end)\{[a-z]*\*?\}|\\[\\{}$]|[{}]|(?:\n\s*)+|@@\d+@@|`+)', re.I)
+# every token starts with one of the characters of the lookahead, which is quicker to rule out
+SPLIT = re.compile(r'(?=[$\\{}\n@`])(\$\$?|\\(?:begin|end)\{[a-z]*\*?\}|\\[\\{}$]|[{}]|(?:\n\s*)+|@@\d+@@|`+)', re.I)
+MARKER = re.compile(r'@@(\d+)@@')
 
 def remove_math(text: str, inline: str) -> dict:
     """
@@ -44,8 +46,8 @@ def remove_math(text: str, inline: str) -> dict:
     stripped_text: the input string with math replaced by @@number@@
     math: a list of the removed math strings
 
-    Break up the text into its component parts and search
-    through them for math delimiters, braces, linebreaks, etc.
+    Break up the text into its component parts and scan
+    them once for math delimiters, braces, linebreaks, etc.
     Math delimiters must match and braces must balance.
     Don't allow math to pass through a double linebreak
     (which will be a paragraph).
@@ -55,23 +57,15 @@ def remove_math(text: str, inline: str) -> dict:
     def process_math(i: int, j: int) -> None:
         """
         The math is in blocks i through j, so
-        collect it into one block and clear the others.
-        # Replace &, <, and > by named entities.
+        collect them into one block and clear them.
         Clear the current math positions and store the index of the
         math, then push the math string onto the storage array.
         """
-        nonlocal blocks, start, end, last
-        # TODO: replacing >, <, & seems to screw up code blocks
-        # block = re.sub(r'>',"&gt;",
-        #     re.sub(r'<',"&lt;",
-        #     re.sub(r'&',"&amp;",
-        #     "".join(blocks[i:j+1]))))
+        nonlocal start, end, last
         block = "".join(blocks[i:j+1])
         if indent:
-            block = re.sub(r'\n    ', '\n', block)
-        while j > i:
-            blocks[j] = ""
-            j -= 1
+            block = block.replace('\n    ', '\n')
+        blocks[i+1:j+1] = [""] * (j - i)
         blocks[i] = f"@@{len(math)}@@"
         math.append(block)
         start = None
@@ -81,11 +75,13 @@ def remove_math(text: str, inline: str) -> dict:
     start = None
     end = None
     last = None
-    indent = None # for tracking math delimiters
+    indent = False # for tracking math delimiters
     braces = None
     math: List[str] = [] # stores math strings for latter
 
-    blocks: List[str] = re.split(SPLIT, re.sub(r'\r\n?', "\n", text))
+    if '\r' in text:
+        text = re.sub(r'\r\n?', "\n", text)
+    blocks: List[str] = SPLIT.split(text)
 
     i = 1
     m = len(blocks)
@@ -115,8 +111,9 @@ def remove_math(text: str, inline: str) -> dict:
                     start = None
                     end = None
                     last = None
-            elif re.search(r'\n.*\n', block) or i + 2 >= m:
+            elif i + 2 >= m or block.count("\n") > 1:
                 if last:
+                    # unbalanced braces or backticks: scan again after them
                     i = last
                     if braces >= 0:
                         process_math(start, i)
@@ -147,12 +144,14 @@ def remove_math(text: str, inline: str) -> dict:
                 end = block
                 braces = -1 # no brace balancing
             elif block[0] == "\n":
-                if re.search(r'    $', block):
+                if block.endswith("    ") or block.endswith("    \n"):
                     indent = True
         i += 2
 
     if last:
         process_math(start, last)
+    if math:
+        text = "".join(blocks)
 
 
     def double_escape_delimiters(text: str, inline: str) -> str:
@@ -163,11 +162,11 @@ def remove_math(text: str, inline: str) -> dict:
         as mathjax equations. Let's double-escape to make sure we still have a `\$`
         after commonmark did its conversion.
         """
-        if not inline.startswith("\\"):
+        if not inline.startswith("\\") and "\\$" in text:
             return re.sub(r'\\\$', '\\\\$', text)
         return text
 
-    return (double_escape_delimiters("".join(blocks), inline), math)
+    return (double_escape_delimiters(text, inline), math)
 
 
 def replace_math(input: str, math: List[str]) -> str:
@@ -185,5 +184,6 @@ def replace_math(input: str, math: List[str]) -> str:
         index = int(match.group(1))
         return math[index]
 
-    text = re.sub(r'@@(\d+)@@', replacer, input)
-    return text
+    if not math:
+        return input
+    return MARKER.sub(replacer, input)
@@ -7,11 +7,14 @@ Extra features include:
 - Managing LaTeX so that MathJax will be able to process it in the browser
 - Syntax highlighting with Pygments
 """
+import bisect
 import re
+from functools import lru_cache
 
 from mistletoe import Document, HTMLRenderer, BaseRenderer, span_token, block_token
 from pygments import highlight
 from pygments.lexers import get_lexer_by_name as get_lexer
+from pygments.util import ClassNotFound
 from pygments.formatters.html import HtmlFormatter
 
 from mathjax_editing import remove_math, replace_math
@@ -19,24 +22,95 @@ from mathjax_editing import remove_math, replace_math
 class RawUrl(span_token.SpanToken):
     """
     Detect raw URLs.
+
+    These are the matches of the regex from
+    https://github.com/trentm/python-markdown2/wiki/link-patterns#converting-links-into-links-automatically
+    except inside HTML tags, before closing HTML tags and in brackets (Markdown links and images).
+    The regex used lookaheads for the latter, which scanned to the end of the text for every URL,
+    so `find` matches its parts separately to take linear time.
     """
     parse_inner = False
-    # regex to extract raw URLs from Markdown from:
-    # https://github.com/trentm/python-markdown2/wiki/link-patterns#converting-links-into-links-automatically
-    pattern = re.compile(
-        r'((([A-Za-z]{3,9}:(?:\/\/)?)'  # scheme
-        r'(?:[\-;:&=\+\$,\w]+@)?[A-Za-z0-9\.\-]+(:\[0-9]+)?'  # user@hostname:port
-        r'|(?:www\.|[\-;:&=\+\$,\w]+@)[A-Za-z0-9\.\-]+)'  # www.|user@hostname
+    scheme = r'([A-Za-z]{3,9}:(?:\/\/)?)'
+    user = r'[\-;:&=\+\$,\w]+@'
+    host = r'[A-Za-z0-9\.\-]'
+    port = r'(:\[0-9]+)?'
+    rest = (
         r'((?:\/[\+~%\/\.\w\-]*)?'  # path
         r'\??(?:[\-\+=&;%@\.\w]*)'  # query parameters
-        r'#?(?:[\.\!\/\\\w\-]*))?)'  # fragment
-        r'(?![^<]*?(?:<\/\w+>|\/?>))'  # ignore anchor HTML tags
-        r'(?![^\(]*?\))'  # ignore links in brackets (Markdown links and images)
+        r'#?(?:[\.\!\/\\\w\-]*))?'  # fragment
     )
+    scheme_url = re.compile('(' + scheme + host + '+' + port + rest + ')')
+    scheme_user_url = re.compile('(' + scheme + user + host + '+' + port + rest + ')')
+    www_or_user_url = re.compile(r'((?:www\.|' + user + ')' + host + '+' + rest + ')')
+
+    scheme_start = re.compile(scheme)
+    www_start = re.compile(r'www\.' + host)
+    # only tried where a run of characters of `user` starts,
+    # since from each of its other characters it would scan to the end of the run again
+    user_start = re.compile(r'(?<![\-;:&=\+\$,\w])' + user + '(?=' + host + ')')
+    closing_tag = re.compile(r'<\/\w+>')
 
     def __init__(self, match):
         self.url = match.group(1)
 
+    @classmethod
+    def find(cls, string):
+        n = len(string)
+        # the `user@` parts followed by a host, which a URL can start anywhere in
+        users = [m.span() for m in cls.user_start.finditer(string)] if '@' in string else []
+        user_starts = [start for start, _ in users]
+        i_user = 0
+        scheme = cls.scheme_start.search(string)
+        www = cls.www_start.search(string)
+        # the next occurrence of each of these characters after the last URL, or `n`
+        next_char = dict.fromkeys('<>()', -1)
+        closing_tag = (-1, False)
+        matches = []
+        pos = 0
+        while pos < n:
+            # the leftmost position where each kind of URL can start
+            if scheme and scheme.start() < pos:
+                scheme = cls.scheme_start.search(string, pos)
+            if www and www.start() < pos:
+                www = cls.www_start.search(string, pos)
+            while i_user < len(users) and users[i_user][1] <= pos + 1:
+                i_user += 1
+            start = min(
+                scheme.start() if scheme else n,
+                www.start() if www else n,
+                max(users[i_user][0], pos) if i_user < len(users) else n)
+            if start == n:
+                break
+
+            match = None
+            if scheme and scheme.start() == start:
+                # the `user@` part, if any, starts right after the scheme
+                i = bisect.bisect_right(user_starts, scheme.end()) - 1
+                has_user = i >= 0 and scheme.end() < users[i][1] - 1
+                match = (cls.scheme_user_url if has_user else cls.scheme_url).match(string, start)
+                if match is None:
+                    # there is no host after the scheme, but there may be a `www.` or `user@` URL here
+                    scheme = cls.scheme_start.search(string, start + 1)
+                    continue
+            if match is None:
+                match = cls.www_or_user_url.match(string, start)
+
+            end = match.end()
+            for c in next_char:
+                if next_char[c] < end:
+                    i = string.find(c, end)
+                    next_char[c] = n if i < 0 else i
+            if closing_tag[0] != next_char['<']:
+                closing_tag = (next_char['<'], cls.closing_tag.match(string, next_char['<']) is not None)
+            if next_char['>'] < next_char['<'] or closing_tag[1] or next_char[')'] < next_char['(']:
+                # the URL is in an HTML tag or brackets, and so is any other URL
+                # before the next of these characters, which no URL contains
+                pos = min(next_char.values())
+                continue
+            matches.append(match)
+            pos = end
+        return matches
+
 class CustomHTMLRenderer(HTMLRenderer):
     """
     The main rendering function is `render_md`.
@@ -98,16 +172,29 @@ class CustomHTMLRenderer(HTMLRenderer):
     # `cssclass` here should agree with what we have in pygments.css
     formatter = HtmlCodeFormatter(cssclass='codehilite')
 
+    @classmethod
+    @lru_cache(maxsize=None)
+    def lexer(cls, language):
+        """ The Pygments lexer for `language`, which is reused for all its code blocks """
+        try:
+            return get_lexer(language)
+        except ClassNotFound:
+            return cls.lexer('text')
+
+    @classmethod
+    @lru_cache(maxsize=4096)
+    def highlight_code(cls, language, code):
+        """
+        `code` highlighted as `language`, cached for all the pages of a run,
+        since docstrings repeat many of the same Lean snippets.
+        """
+        return highlight(code, cls.lexer(language), cls.formatter)
+
     def render_block_code(self, token):
         # replace math before highlighting
         code = replace_math(token.children[0].content, self.math)
-        try:
-            # default to 'lean' if no language is specified
-            lexer = get_lexer(
-                token.language) if token.language else get_lexer('lean')
-        except:
-            lexer = get_lexer('text')
-        return highlight(code, lexer, self.formatter)
+        # default to 'lean' if no language is specified
+        return self.highlight_code(token.language or 'lean', code)
 
     def render_raw_url(self, token):
         """
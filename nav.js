@@ -13,21 +13,48 @@ function saveExpanded() {
     Object.getOwnPropertyNames(expanded).filter((e) => expanded[e]).join(","));
 }
 
-for (const elem of document.getElementsByClassName('nav_sect')) {
-  const id = elem.getAttribute('data-path');
-  if (!id) continue;
-  if (expanded[id]) {
-    elem.open = true;
+// Library navigation tree
+// -----------------------
+
+// The tree is the same on every page, so it is rendered once by print_docs.py
+// into library_nav.html; here we load it and open the path to the current page.
+async function loadLibraryNav() {
+  const libraryNav = document.getElementById('library_nav');
+  if (!libraryNav) return;
+  const res = await fetch(`${siteRoot}library_nav.html`);
+  if (!res.ok) return;
+  libraryNav.innerHTML = await res.text();
+
+  const activePath = libraryNav.dataset.activePath;
+  for (const elem of libraryNav.getElementsByClassName('nav_sect')) {
+    if (activePath.startsWith(elem.dataset.path + '/')) {
+      elem.open = true;
+    }
+  }
+  for (const elem of libraryNav.getElementsByClassName('nav_link')) {
+    if (elem.dataset.path === activePath) {
+      elem.classList.add('visible');
+    }
   }
-  elem.addEventListener('toggle', () => {
-    expanded[id] = elem.open;
-    saveExpanded();
-  });
 }
 
-for (const currentFileLink of document.getElementsByClassName('visible')) {
-  currentFileLink.scrollIntoView({block: 'center'});
-}
+loadLibraryNav().catch(() => {}).then(() => {
+  for (const elem of document.getElementsByClassName('nav_sect')) {
+    const id = elem.getAttribute('data-path');
+    if (!id) continue;
+    if (expanded[id]) {
+      elem.open = true;
+    }
+    elem.addEventListener('toggle', () => {
+      expanded[id] = elem.open;
+      saveExpanded();
+    });
+  }
+
+  for (const currentFileLink of document.getElementsByClassName('visible')) {
+    currentFileLink.scrollIntoView({block: 'center'});
+  }
+});
 
 
 
@@ -106,23 +133,23 @@ if (tse != null) {
 // Simple declaration search
 // -------------------------
 
-const declURL = new URL(`${siteRoot}searchable_data.bmp`, window.location);
-const getDecls = (() => {
-  let decls;
+// the index written by `write_search_index` in print_docs.py
+const searchIndexURL = new URL(`${siteRoot}search_index/`, window.location);
+const fetchSearchIndex = (file) => fetch(new URL(file, searchIndexURL)).then((res) => res.json());
+const getSearchIndex = (() => {
+  let index;
+  const docShards = {};
+  const loadDocShard = (n) => docShards[n] || (docShards[n] = fetchSearchIndex(`${n}.json`));
+  let docs;
+  const loadDocs = () => docs || (docs = fetch(new URL(`${siteRoot}searchable_data.bmp`, window.location))
+    .then((res) => res.json()).then(loadDocstrings));
   return () => {
-    if (!decls) decls = new Promise((resolve, reject) => {
-        const req = new XMLHttpRequest();
-        req.responseType = 'json';
-        req.addEventListener('load', () => resolve(loadDecls(req.response)));
-        req.addEventListener('error', () => reject());
-        req.open('GET', declURL);
-        req.send();
-      })
-    return decls;
+    if (!index) index = fetchSearchIndex('names.json').then((names) => ({decls: loadDecls(names), loadDocShard, loadDocs}));
+    return index;
   }
 })()
 
-const declSearch = async (q) => getMatches(await getDecls(), q);
+const declSearch = async (q) => getMatches(await getSearchIndex(), q);
 
 const srId = 'search_results';
 document.getElementById('search_form')
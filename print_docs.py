@@ -14,19 +14,31 @@ import textwrap
 import re
 import subprocess
 import toml
-import shutil
 import argparse
 import html
 import gzip
+import hashlib
+import io
+import multiprocessing
+import random
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from urllib.parse import quote
-from functools import reduce
+from functools import reduce, lru_cache, cached_property
 import textwrap
 from collections import Counter, defaultdict, namedtuple
+from collections.abc import Mapping
 from pathlib import Path
 from typing import NamedTuple, List, Optional
+import sqlite3
 import sys
+import time
 
 import mistletoe
+import pygments
+import mathjax_editing
+import mistletoe_renderer
 from mistletoe_renderer import CustomHTMLRenderer, PlaintextSummaryRenderer
 import pybtex.database
 from pybtex.style.labels.alpha import LabelStyle
@@ -42,11 +54,38 @@ env = Environment(
 )
 env.globals['sorted'] = sorted
 
+def render_template(template_name, **context):
+  if profiler is None:
+    return env.get_template(template_name).render(**context)
+  start = time.perf_counter()
+  try:
+    return env.get_template(template_name).render(**context)
+  finally:
+    profiler.add_template(template_name, time.perf_counter() - start)
+
 parser = argparse.ArgumentParser('Options to print_docs.py')
 parser.add_argument('-w', help = 'Specify site root URL')
 parser.add_argument('-l', help = 'Symlink CSS and JS instead of copying', action = "store_true")
 parser.add_argument('-r', help = 'relative path to mathlib root directory')
 parser.add_argument('-t', help = 'relative path to html output directory')
+parser.add_argument('-j', '--jobs', help = 'Number of worker processes used to render module pages and trace imports', type = int, default = 1)
+parser.add_argument('--cache-dir', help = 'Directory for caches that are reused between runs')
+parser.add_argument('--markdown-cache-size', help = 'Maximum size in MB of the rendered markdown cache in --cache-dir', type = int, default = 256)
+parser.add_argument('--deps-backend', help = 'How to trace imports: run `lean --deps`, or read the import lines of each file', choices = ['lean', 'native'], default = 'lean')
+parser.add_argument('--redirects', help = 'Write a redirect page for each declaration under find/, or a sharded table that 404.html resolves them with', choices = ['pages', 'shards'], default = 'pages')
+parser.add_argument('--export-db-shards', help = 'Also split export_db.json.gz into one file per project or module under export_db/', choices = ['project', 'module'])
+parser.add_argument('--export-db-compresslevel', help = 'gzip compression level of export_db.json.gz, from 1 (fastest) to 9 (smallest)', type = int, choices = range(1, 10), default = 9, metavar = 'LEVEL')
+parser.add_argument('--incremental', help = 'Only write the module pages whose inputs changed since the last run with the same --cache-dir', action = "store_true")
+parser.add_argument('--clean', help = 'Remove the files in the html output directory that this run did not write', action = "store_true")
+parser.add_argument('--changes', help = 'Write the paths of the files in the html output directory that this run added, changed or removed to a JSON file', metavar = 'FILE')
+parser.add_argument('--profile', help = 'Write the wall time, CPU time and peak memory of each phase, the render times of the templates and the slowest module pages to a JSON file', metavar = 'FILE')
+parser.add_argument('--profile-modules', help = 'Number of slowest module pages in the --profile report', type = int, default = 20, metavar = 'N')
+parser.add_argument('--config', help = 'Read the values probed from leanpkg.toml, lean and git from a JSON file written by --save-config, instead of probing them', metavar = 'FILE')
+parser.add_argument('--save-config', help = 'Write the values probed from leanpkg.toml, lean and git to a JSON file', metavar = 'FILE')
+parser.add_argument('--lean-commit', help = 'The Lean commit, instead of running `lean --run src/lean_commit.lean`')
+parser.add_argument('--lean-path', help = 'A directory of the Lean search path, instead of running `lean --path`; can be repeated', action = 'append', metavar = 'DIR')
+parser.add_argument('--docgen-commit', help = 'The doc-gen commit, instead of running `git rev-parse HEAD`')
+parser.add_argument('--check-deps', help = 'Compare the imports found by both backends on a sample of N files', type = int, metavar = 'N')
 
 
 # extra doc files to include in generation
@@ -137,30 +176,76 @@ def parse_bib_file(fname):
 
   return bib
 
-with open('leanpkg.toml') as f:
-  parsed_toml = toml.loads(f.read())
-ml_data = parsed_toml['dependencies']['mathlib']
-mathlib_commit = ml_data['rev']
-mathlib_github_root = ml_data['git'].strip('/')
-
-# contains an array of [prefix, replacement] strings to be rewritten by nav.js
-url_rewrites = []
+class Config:
+  """
+  The values that doc-gen reads from the toolchain: `leanpkg.toml`, `lean` and `git`.
 
-mathlib_github_src_root_with_commit = f"{mathlib_github_root}/blob/{mathlib_commit}/src/"
-mathlib_github_src_root = f"{mathlib_github_root}/blob/master/src/"
-url_rewrites.append([mathlib_github_src_root, mathlib_github_src_root_with_commit])
+  Each value is computed the first time it is used, so importing this module runs nothing.
+  Setting a value beforehand (see `--config` and the options that override single values)
+  skips computing it.
+  """
+  # the values read by `--config` and written by `--save-config`
+  keys = ['mathlib_commit', 'mathlib_github_root', 'lean_commit', 'lean_path', 'docgen_commit']
+
+  @cached_property
+  def leanpkg(self):
+    with open('leanpkg.toml') as f:
+      return toml.loads(f.read())
+
+  @cached_property
+  def mathlib_commit(self):
+    return self.leanpkg['dependencies']['mathlib']['rev']
+
+  @cached_property
+  def mathlib_github_root(self):
+    return self.leanpkg['dependencies']['mathlib']['git'].strip('/')
+
+  @cached_property
+  def lean_commit(self):
+    return subprocess.check_output(['lean', '--run', 'src/lean_commit.lean']).decode()
+
+  @cached_property
+  def lean_path(self):
+    return json.loads(subprocess.check_output(['lean', '--path']).decode())['path']
+
+  @cached_property
+  def path_info(self):
+    return [(Path(p).resolve(), get_name_from_leanpkg_path(Path(p))) for p in self.lean_path]
+
+  @cached_property
+  def docgen_commit(self):
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD']).decode().strip()  # removing '\n'
+
+  @cached_property
+  def url_rewrites(self):
+    """ An array of [prefix, replacement] strings to be rewritten by nav.js """
+    return [[f"{self.mathlib_github_root}/blob/master/{d}/", f"{self.mathlib_github_root}/blob/{self.mathlib_commit}/{d}/"]
+      for d in ['src', 'archive', 'counterexamples']]
+
+  # TODO: allow extending this for third-party projects
+  @cached_property
+  def library_link_roots(self):
+    return {
+      # The Lean version changes infrequently enough that we don't need to rewrite it
+      'core': f'https://github.com/leanprover-community/lean/blob/{self.lean_commit}/library/',
+      'mathlib': f"{self.mathlib_github_root}/blob/master/src/",
+      'mathlib-archive': f"{self.mathlib_github_root}/blob/master/archive/",
+      'mathlib-counterexamples': f"{self.mathlib_github_root}/blob/master/counterexamples/",
+    }
 
-mathlib_github_archive_root_with_commit = f"{mathlib_github_root}/blob/{mathlib_commit}/archive/"
-mathlib_github_archive_root = f"{mathlib_github_root}/blob/master/archive/"
-url_rewrites.append([mathlib_github_archive_root, mathlib_github_archive_root_with_commit])
+  def load(self, path):
+    """ Sets the values in a JSON file written by `save`, except those that were already set """
+    with open(path, encoding='utf-8') as f:
+      values = json.load(f)
+    for key in self.keys:
+      if key in values and key not in self.__dict__:
+        setattr(self, key, values[key])
 
-mathlib_github_counterexamples_root_with_commit = f"{mathlib_github_root}/blob/{mathlib_commit}/counterexamples/"
-mathlib_github_counterexamples_root = f"{mathlib_github_root}/blob/master/counterexamples/"
-url_rewrites.append([mathlib_github_counterexamples_root, mathlib_github_counterexamples_root_with_commit])
+  def save(self, path):
+    with open(path, 'w', encoding='utf-8') as f:
+      json.dump({key: getattr(self, key) for key in self.keys}, f, indent=1)
 
-# The Lean version changes infrequently enough that we don't need to rewrite it
-lean_commit = subprocess.check_output(['lean', '--run', 'src/lean_commit.lean']).decode()
-lean_root = f'https://github.com/leanprover-community/lean/blob/{lean_commit}/library/'
+config = Config()
 
 def get_name_from_leanpkg_path(p: Path) -> str:
   """ get the package name corresponding to a source path """
@@ -194,28 +279,24 @@ def get_name_from_leanpkg_path(p: Path) -> str:
 
   return '<unknown>'
 
-lean_paths = [
-  Path(p)
-  for p in json.loads(subprocess.check_output(['lean', '--path']).decode())['path']
-]
-path_info = [(p.resolve(), get_name_from_leanpkg_path(p)) for p in lean_paths]
-
 class ImportName(NamedTuple):
   project: str
   parts: List[str]
   raw_path: Path
 
   @classmethod
+  @lru_cache(maxsize=None)
   def of(cls, fname: str):
+    """ Memoized, since most filenames are shared by many declarations. """
     fname = Path(fname)
-    for p, name in path_info:
+    for p, name in config.path_info:
       try:
         rel_path = fname.relative_to(p)
       except ValueError:
         pass
       else:
         return cls(name, rel_path.with_suffix('').parts, fname)
-    path_details = "".join(f" - {p}\n" for p, _ in path_info)
+    path_details = "".join(f" - {p}\n" for p, _ in config.path_info)
     raise RuntimeError(
       f"Cannot determine import name for {fname}; it is not within any of the directories returned by `lean --path`:\n"
       f"{path_details}"
@@ -232,26 +313,190 @@ class ImportName(NamedTuple):
   def url(self):
     return '/'.join(self.parts) + '.html'
 
-docgen_commit = subprocess.check_output(['git', 'rev-parse', 'HEAD']).decode().strip()  # removing '\n'
+markdown_renderer = CustomHTMLRenderer()
 
-env.globals['mathlib_github_root'] = mathlib_github_root
-env.globals['mathlib_commit'] = mathlib_commit
-env.globals['lean_commit'] = lean_commit
-env.globals['docgen_commit'] = docgen_commit
+def markdown_renderer_version() -> str:
+  """ A hash of everything that can change the output of `CustomHTMLRenderer.render_md` """
+  h = hashlib.sha256()
+  for dep in (mistletoe, pygments):
+    h.update(dep.__version__.encode())
+  for module in (mistletoe_renderer, mathjax_editing):
+    with open(module.__file__, 'rb') as f:
+      h.update(f.read())
+  return h.hexdigest()
+
+class MarkdownCache:
+  """
+  A persistent cache of rendered markdown, stored in an sqlite database and keyed
+  by a hash of the markdown and of `markdown_renderer_version`.
 
-markdown_renderer = CustomHTMLRenderer()
+  The least recently used entries are evicted once the total size of the cached
+  HTML exceeds `max_bytes`.
+  """
+  def __init__(self, path, max_bytes):
+    self.path = path
+    self.max_bytes = max_bytes
+    self.version = markdown_renderer_version()
+    self.stamp = int(time.time())
+    self.hits = 0
+    self.misses = 0
+    self.new_entries = []
+    self.used_keys = []
+    self.conn = None
+    self.pid = None
+
+  def connect(self):
+    # sqlite connections must not be shared with forked worker processes
+    if self.pid != os.getpid():
+      os.makedirs(os.path.dirname(self.path), exist_ok=True)
+      self.conn = sqlite3.connect(self.path, timeout=600)
+      self.conn.execute('PRAGMA journal_mode=WAL')
+      self.conn.execute('CREATE TABLE IF NOT EXISTS markdown '
+        '(key TEXT PRIMARY KEY, html TEXT, size INTEGER, last_used INTEGER)')
+      self.pid = os.getpid()
+    return self.conn
+
+  def render(self, ds, render_md):
+    key = hashlib.sha256(f'{self.version}\0{ds}'.encode()).hexdigest()
+    row = self.connect().execute('SELECT html FROM markdown WHERE key = ?', (key,)).fetchone()
+    if row is not None:
+      self.hits += 1
+      self.used_keys.append(key)
+      return row[0]
+    self.misses += 1
+    html = render_md(ds)
+    self.new_entries.append((key, html))
+    if len(self.new_entries) >= 1000:
+      self.flush()
+    return html
+
+  def flush(self):
+    if not self.new_entries and not self.used_keys:
+      return
+    conn = self.connect()
+    with conn:
+      conn.executemany('INSERT OR REPLACE INTO markdown VALUES (?, ?, ?, ?)',
+        [(key, html, len(html.encode()), self.stamp) for key, html in self.new_entries])
+      conn.executemany('UPDATE markdown SET last_used = ? WHERE key = ?',
+        [(self.stamp, key) for key in self.used_keys])
+    self.new_entries = []
+    self.used_keys = []
+
+  def disconnect(self):
+    """
+    Flush and close the connection of this process, which `connect` opens again when needed.
+    Called before forking worker processes, which would otherwise write the pending entries again.
+    """
+    self.flush()
+    if self.conn is not None and self.pid == os.getpid():
+      self.conn.close()
+    self.conn = None
+    self.pid = None
+
+  def close(self):
+    """ Flush, evict old entries and print statistics. """
+    self.flush()
+    conn = self.connect()
+    total = 0
+    evicted = []
+    for key, size in conn.execute('SELECT key, size FROM markdown ORDER BY last_used DESC'):
+      total += size
+      if total > self.max_bytes:
+        evicted.append((key,))
+    with conn:
+      conn.executemany('DELETE FROM markdown WHERE key = ?', evicted)
+    self.disconnect()
+    print(f"convert_markdown: {self.hits} cache hits, {self.misses} misses, "
+      f"evicted {len(evicted)} entries")
+
+markdown_cache: Optional[MarkdownCache] = None
+
+class Profiler:
+  """
+  Collects the report of `--profile`: the wall time, CPU time (including worker
+  processes) and maximum resident set size after each phase of `main`, and the
+  render times of the templates and the module pages. Phases can be nested;
+  the time of a template includes the templates it renders, e.g. `decl_header.j2`.
+  """
+  def __init__(self):
+    self.phases = []
+    self.stack = []
+    self.templates = defaultdict(lambda: [0, 0.])
+    self.pages = []
+    self.start = time.perf_counter()
+
+  @contextmanager
+  def phase(self, name):
+    self.stack.append(name)
+    wall, cpu = time.perf_counter(), sum(os.times()[:4])
+    try:
+      yield
+    finally:
+      self.phases.append({
+        'phase': '/'.join(self.stack),
+        'wall': time.perf_counter() - wall,
+        'cpu': sum(os.times()[:4]) - cpu,
+        'max_rss_mb': max_rss_mb(),
+        'max_rss_workers_mb': max_rss_mb(children = True),
+      })
+      self.stack.pop()
+
+  def add_template(self, name, seconds):
+    self.templates[name][0] += 1
+    self.templates[name][1] += seconds
+
+  def take_pages(self):
+    """ The template and page times since the last call, to be merged into the profiler of the parent process """
+    taken = dict(self.templates), self.pages
+    self.templates.clear()
+    self.pages = []
+    return taken
+
+  def merge_pages(self, taken):
+    templates, pages = taken
+    for name, (count, seconds) in templates.items():
+      self.templates[name][0] += count
+      self.templates[name][1] += seconds
+    self.pages.extend(pages)
+
+  def report(self, n_pages):
+    return {
+      'argv': sys.argv[1:],
+      'wall': time.perf_counter() - self.start,
+      'phases': self.phases,
+      'templates': {name: {'count': count, 'seconds': seconds}
+        for name, (count, seconds) in sorted(self.templates.items(), key = lambda t: -t[1][1])},
+      'module_pages': {'count': len(self.pages), 'seconds': sum(seconds for seconds, _ in self.pages)},
+      'slowest_module_pages': [{'page': url, 'seconds': seconds}
+        for seconds, url in sorted(self.pages, reverse = True)[:n_pages]],
+    }
+
+def max_rss_mb(children = False):
+  """ The maximum RSS of this process or of its finished workers, or None where `resource` is missing (Windows) """
+  try:
+    import resource
+  except ImportError:
+    return None
+  usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+  # in kilobytes on Linux, but in bytes on macOS
+  return usage.ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+
+# set by `--profile`
+profiler: Optional[Profiler] = None
+
+@contextmanager
+def phase(name):
+  if profiler is None:
+    yield
+  else:
+    with profiler.phase(name):
+      yield
 
 def convert_markdown(ds):
+  if markdown_cache is not None:
+    return markdown_cache.render(ds, markdown_renderer.render_md)
   return markdown_renderer.render_md(ds)
 
-# TODO: allow extending this for third-party projects
-library_link_roots = {
-  'core': lean_root,
-  'mathlib': mathlib_github_src_root,
-  'mathlib-archive': mathlib_github_archive_root,
-  'mathlib-counterexamples': mathlib_github_counterexamples_root,
-}
-
 # TODO: allow extending this for third-party projects
 canonical_roots = {
   'core': 'https://leanprover-community.github.io/mathlib_docs',
@@ -269,7 +514,7 @@ def get_canonical_url(path, project='mathlib'):
 
 def library_link(filename: ImportName, line=None):
   try:
-    root = library_link_roots[filename.project]
+    root = config.library_link_roots[filename.project]
   except KeyError:
     return ""  # empty string is handled as a self-link
 
@@ -281,73 +526,551 @@ def library_link(filename: ImportName, line=None):
 env.globals['library_link'] = library_link
 env.filters['library_link'] = library_link
 
-def name_in_decl(decl_name, dmap):
-  if dmap['name'] == decl_name:
-    return True
-  if decl_name in [sf[0] for sf in dmap['structure_fields']]:
-    return True
-  if decl_name in [sf[0] for sf in dmap['constructors']]:
-    return True
-  return False
-
-def library_link_from_decl_name(decl_name, decl_loc, file_map):
+def owner_of_decl_name(decl_name, decl_loc, owner_map):
   try:
-    e = next(d for d in file_map[decl_loc] if name_in_decl(decl_name, d))
-  except StopIteration as e:
+    return owner_map[decl_loc][decl_name]
+  except KeyError as e:
     if decl_name[-3:] == '.mk':
-      return library_link_from_decl_name(decl_name[:-3], decl_loc, file_map)
-    print(f'{decl_name} appears in {decl_loc}, but we do not have data for that declaration. file_map:')
-    print(file_map[decl_loc])
+      return owner_of_decl_name(decl_name[:-3], decl_loc, owner_map)
+    print(f'{decl_name} appears in {decl_loc}, but we do not have data for that declaration. Names in that file:')
+    print(sorted(owner_map[decl_loc]))
     raise e
-  return library_link(decl_loc, e['line'])
+
+def library_link_from_decl_name(decl_name, decl_loc, owner_map):
+  return library_link(decl_loc, owner_of_decl_name(decl_name, decl_loc, owner_map)['line'])
+
+# the files written to `html_root` by this run, relative to it, with 'added', 'changed' or 'unchanged'
+output_log = {}
+
+def write_outfile(filename, data: bytes):
+  """ Writes `data` to `filename` in `html_root`, unless the file already has this content """
+  path = os.path.join(html_root, filename)
+  status = 'added'
+  if os.path.lexists(path):
+    status = 'changed'
+    if not os.path.islink(path) and os.path.getsize(path) == len(data):
+      with open(path, 'rb') as f:
+        if f.read() == data:
+          status = 'unchanged'
+  if status != 'unchanged':
+    if os.path.islink(path):
+      # left by -l, and writing would change the target
+      os.remove(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+      f.write(data)
+  output_log[os.path.relpath(path, html_root)] = status
+
+def keep_outfile(filename):
+  """ Records that a file in `html_root` from an earlier run is part of the output of this one """
+  output_log[os.path.relpath(os.path.join(html_root, filename), html_root)] = 'unchanged'
+
+def same_file_contents(path, other_path, chunk_size = 1 << 20):
+  if os.path.getsize(path) != os.path.getsize(other_path):
+    return False
+  with open(path, 'rb') as f, open(other_path, 'rb') as other:
+    while True:
+      chunk = f.read(chunk_size)
+      if chunk != other.read(chunk_size):
+        return False
+      if not chunk:
+        return True
+
+class OutFile:
+  """
+  A file in `html_root`, written when it is closed unless it already has this content.
+  Text is buffered and written by `write_outfile`, but binary files such as `export_db.json.gz`
+  can be large, so they go to a hidden file next to the target, which replaces it if it changed.
+  """
+  def __init__(self, filename, mode):
+    self.filename = filename
+    self.binary = 'b' in mode
+    if self.binary:
+      self.path = os.path.join(html_root, filename)
+      self.temp_path = os.path.join(os.path.dirname(self.path), f'.{os.path.basename(self.path)}.tmp')
+      os.makedirs(os.path.dirname(self.path), exist_ok=True)
+      self.buffer = open(self.temp_path, 'wb')
+    else:
+      self.buffer = io.StringIO()
+    self.write = self.buffer.write
+
+  def flush(self):
+    pass
+
+  def close(self):
+    if not self.binary:
+      write_outfile(self.filename, self.buffer.getvalue().encode('utf-8'))
+      return
+    self.buffer.close()
+    status = 'added'
+    if os.path.lexists(self.path):
+      status = 'changed'
+      if not os.path.islink(self.path) and same_file_contents(self.path, self.temp_path):
+        status = 'unchanged'
+    if status == 'unchanged':
+      os.remove(self.temp_path)
+    else:
+      # a link left by -l is replaced, not its target
+      os.replace(self.temp_path, self.path)
+    output_log[os.path.relpath(self.path, html_root)] = status
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    # a file is not written if its contents could not be generated
+    if exc_type is None:
+      self.close()
+    elif self.binary:
+      self.buffer.close()
+      os.remove(self.temp_path)
 
 def open_outfile(filename, mode = 'w'):
-    filename = os.path.join(html_root, filename)
-    os.makedirs(os.path.dirname(filename), exist_ok=True)
-    return open(filename, mode, encoding='utf-8')
+    return OutFile(filename, mode)
+
+def copy_outfile(source, filename):
+  with open(source, 'rb') as f, open_outfile(filename, 'wb') as out:
+    shutil.copyfileobj(f, out)
+
+def finish_output(clean = False):
+  """
+  Returns the paths in `html_root` that this run added, changed or did not write,
+  and with `clean` removes the latter. Hidden files and directories are left alone.
+  """
+  changes = {'added': [], 'changed': [], 'removed': []}
+  for path, status in sorted(output_log.items()):
+    if status != 'unchanged':
+      changes[status].append(path)
+  for dirpath, dirnames, filenames in os.walk(html_root, topdown=False):
+    if any(part.startswith('.') for part in Path(os.path.relpath(dirpath, html_root)).parts):
+      continue
+    for filename in filenames:
+      path = os.path.relpath(os.path.join(dirpath, filename), html_root)
+      if path not in output_log and not filename.startswith('.'):
+        changes['removed'].append(path)
+        if clean:
+          os.remove(os.path.join(dirpath, filename))
+    if clean and dirpath.rstrip('/') != html_root.rstrip('/') and not os.listdir(dirpath):
+      os.rmdir(dirpath)
+  changes['removed'].sort()
+  return changes
 
 def separate_results(objs):
   file_map = defaultdict(list)
   loc_map = {}
+  # for each file, the first declaration with a given name
+  decl_map = defaultdict(dict)
+  # for each file, the first declaration that a name belongs to,
+  # either as its own name or as a structure field or constructor
+  owner_map = defaultdict(dict)
   for obj in objs:
-    # replace the filenames in-place with parsed filename objects
-    i_name = obj['filename'] = ImportName.of(obj['filename'])
+    i_name = obj['filename']
     if i_name.project == '.':
       continue  # this is doc-gen itself
     file_map[i_name].append(obj)
+    decl_map[i_name].setdefault(obj['name'], obj)
+    owners = owner_map[i_name]
+    owners.setdefault(obj['name'], obj)
     loc_map[obj['name']] = i_name
     for (cstr_name, tp) in obj['constructors']:
       loc_map[cstr_name] = i_name
+      owners.setdefault(cstr_name, obj)
     for (sf_name, tp) in obj['structure_fields']:
       loc_map[sf_name] = i_name
+      owners.setdefault(sf_name, obj)
     if len(obj['structure_fields']) > 0:
       loc_map[obj['name'] + '.mk'] = i_name
-  return file_map, loc_map
+  return file_map, loc_map, decl_map, owner_map
 
-def trace_deps(file_map):
+def load_json_cache(cache_file):
+  try:
+    with open(cache_file, 'r', encoding='utf-8') as f:
+      return json.load(f)
+  except (FileNotFoundError, json.JSONDecodeError):
+    return {}
+
+def write_json_cache(cache_file, data):
+  os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+  with open(cache_file, 'w', encoding='utf-8') as f:
+    json.dump(data, f)
+
+def lean_deps(path: Path) -> List[str]:
+  return subprocess.check_output(['lean', '--deps', str(path)]).decode().split()
+
+# commands that can follow the imports; these are keywords, so they end the list of imports
+lean_command_keywords = {
+  'open', 'export', 'namespace', 'section', 'end', 'universe', 'universes', 'variable', 'variables',
+  'parameter', 'parameters', 'constant', 'constants', 'axiom', 'axioms', 'def', 'definition',
+  'theorem', 'lemma', 'example', 'instance', 'class', 'structure', 'inductive', 'mutual', 'meta',
+  'noncomputable', 'private', 'protected', 'local', 'attribute', 'notation', 'infix', 'infixl',
+  'infixr', 'postfix', 'prefix', 'reserve', 'precedence', 'set_option', 'run_cmd', 'abbreviation',
+  'include', 'omit', 'init_quotient', 'declare_trace', 'add_key_equivalence', 'run_parser',
+}
+lean_token = re.compile(r'--[^\n]*|/-|(?:(?!--|/-)\S)+')
+lean_block_comment_delim = re.compile(r'/-|-/')
+lean_module_name = re.compile(r'\.*[^\W\d][\w.\'!?]*')
+
+def import_names(source: str) -> List[str]:
+  """
+  Parse the header of a Lean file, returning the imported module names in order.
+
+  Relative imports keep their leading dots. `init` is imported implicitly unless
+  the file starts with `prelude`, as in Lean's own `parse_imports`.
+  """
+  imports = []
+  prelude = False
+  in_imports = False
+  pos = 0
+  while True:
+    m = lean_token.search(source, pos)
+    if m is None:
+      break
+    tok = m.group(0)
+    pos = m.end()
+    if tok.startswith('--'):
+      continue
+    if tok == '/-' and not source.startswith(('/--', '/-!'), m.start()):
+      # skip a (nested) block comment
+      depth = 1
+      while depth > 0:
+        m = lean_block_comment_delim.search(source, pos)
+        if m is None:
+          break
+        depth += 1 if m.group(0) == '/-' else -1
+        pos = m.end()
+    elif tok == 'prelude' and not in_imports and not prelude:
+      prelude = True
+    elif tok == 'import':
+      in_imports = True
+    elif in_imports and tok not in lean_command_keywords and lean_module_name.fullmatch(tok):
+      imports.append(tok)
+    else:
+      break  # the first command (or doc comment) ends the imports
+  return ([] if prelude else ['init']) + imports
+
+def resolve_import(name: str, importing_file: Path) -> Optional[Path]:
+  """ Find the `.lean` file for an imported module, like Lean does. """
+  dots = len(name) - len(name.lstrip('.'))
+  parts = name.lstrip('.').split('.')
+  if dots == 0:
+    roots = [p for p, _ in config.path_info]
+  else:
+    root = importing_file.parent
+    for _ in range(dots - 1):
+      root = root.parent
+    roots = [root]
+  for root in roots:
+    for candidate in (root.joinpath(*parts).with_suffix('.lean'), root.joinpath(*parts, 'default.lean')):
+      if candidate.is_file():
+        return candidate
+  return None
+
+def native_deps(path: Path) -> List[str]:
+  with open(path, 'r', encoding='utf-8') as f:
+    source = f.read()
+  deps = []
+  for name in import_names(source):
+    dep = resolve_import(name, path)
+    if dep is None:
+      print(f"trace_deps: Cannot find import {name} of {path}")
+      continue
+    deps.append(str(dep))
+  return deps
+
+deps_backends = {'lean': lean_deps, 'native': native_deps}
+
+def lean_sources_digest(lean_path):
+  """ A hash of the paths of the `.lean` files in the directories of `lean_path` """
+  h = hashlib.sha256()
+  for root in lean_path:
+    h.update(f'{root}\n'.encode('utf-8'))
+    for dirpath, dirnames, filenames in os.walk(root):
+      dirnames.sort()
+      for filename in sorted(filenames):
+        if filename.endswith('.lean'):
+          h.update(f'{os.path.relpath(os.path.join(dirpath, filename), root)}\n'.encode('utf-8'))
+  return h.hexdigest()
+
+def trace_deps(file_map, jobs = 1, cache_dir = None, backend = 'lean'):
+  """
+  Build the import graph by running `lean --deps` on every file, `jobs` at a time,
+  or with `backend = 'native'` by parsing the imports of every file directly.
+
+  If `cache_dir` is given, the output of `lean --deps` is stored there, keyed by
+  the path and content hash of each file, and reused by the next run with the same
+  Lean installation and the same source files on the Lean path, as long as the
+  files it lists still exist.
+  """
   graph = nx.DiGraph()
   import_name_by_path = {k.raw_path: k for k in file_map}
+  use_cache = cache_dir and backend == 'lean'
+  cache_file = os.path.join(cache_dir, 'deps.json') if use_cache else None
+  cache = {}
+  if cache_file:
+    # the paths printed by `lean --deps` also depend on where Lean finds the imported modules
+    # and on which files are there, e.g. a new `foo.lean` shadows `foo/default.lean`
+    toolchain = {'lean_commit': config.lean_commit, 'lean_path': config.lean_path,
+      'lean_sources': lean_sources_digest(config.lean_path)}
+    cache = load_json_cache(cache_file)
+    cache = cache.get('files', {}) if cache.get('toolchain') == toolchain else {}
+  n_cached = 0
+
+  def file_deps(k):
+    if backend != 'lean':
+      return None, deps_backends[backend](k.raw_path), False
+    if not cache_file:
+      return None, lean_deps(k.raw_path), False
+    with open(k.raw_path, 'rb') as f:
+      digest = hashlib.sha256(f.read()).hexdigest()
+    entry = cache.get(str(k.raw_path))
+    # an import can resolve to another file if one was removed, e.g. `foo.lean` for `foo/default.lean`
+    if entry is not None and entry['hash'] == digest and all(Path(p).with_suffix('.lean').exists() for p in entry['deps']):
+      return digest, entry['deps'], True
+    return digest, lean_deps(k.raw_path), False
+
+  new_cache = {}
   n = 0
   n_ok = 0
-  for k in file_map:
-    deps = subprocess.check_output(['lean', '--deps', str(k.raw_path)]).decode()
-    graph.add_node(k)
-    for p in deps.split():
-      n += 1
-      try:
-        p = import_name_by_path[Path(p).with_suffix('.lean')]
-      except KeyError:
-        print(f"trace_deps: Path not recognized: {p}")
-        continue
-      graph.add_edge(k, p)
-      n_ok += 1
+  with ThreadPoolExecutor(max_workers = max(jobs, 1)) as executor:
+    for k, (digest, deps, cached) in zip(file_map, executor.map(file_deps, file_map)):
+      new_cache[str(k.raw_path)] = {'hash': digest, 'deps': deps}
+      n_cached += cached
+      graph.add_node(k)
+      for p in deps:
+        n += 1
+        try:
+          p = import_name_by_path[Path(p).with_suffix('.lean')]
+        except KeyError:
+          print(f"trace_deps: Path not recognized: {p}")
+          continue
+        graph.add_edge(k, p)
+        n_ok += 1
+  if cache_file:
+    write_json_cache(cache_file, {'toolchain': toolchain, 'files': new_cache})
+    print(f"trace_deps: Reused cached dependencies for {n_cached} / {len(file_map)} files")
   print(f"trace_deps: Processed {n_ok} / {n} dependency links")
   return graph
 
+def check_deps(file_map, sample_size, jobs = 1):
+  """
+  Compare the imports found by `native_deps` with those of `lean --deps`
+  on a random sample of files. Returns the number of files that differ.
+  """
+  files = random.Random(0).sample(list(file_map), min(sample_size, len(file_map)))
+
+  def compare(k):
+    lean = {Path(p).with_suffix('.lean') for p in lean_deps(k.raw_path)}
+    native = {Path(p) for p in native_deps(k.raw_path)}
+    return lean - native, native - lean
+
+  n_bad = 0
+  with ThreadPoolExecutor(max_workers = max(jobs, 1)) as executor:
+    for k, (only_lean, only_native) in zip(files, executor.map(compare, files)):
+      if only_lean or only_native:
+        n_bad += 1
+        print(f"check_deps: {k}: only found by lean: {sorted(map(str, only_lean))}, "
+          f"only found natively: {sorted(map(str, only_native))}")
+  print(f"check_deps: {len(files) - n_bad} / {len(files)} files have the same imports")
+  return n_bad
+
+json_whitespace = re.compile(r'[ \t\n\r]*')
+json_delimiters = set(' \t\n\r,:]}')
+
+def stream_export_json(f, chunk_size = 1 << 20):
+  """
+  Parse the top-level object of `export.json` incrementally from the file `f`.
+
+  Yields `(key, value)` pairs. The value for `decls` is a generator over the
+  declarations, which is exhausted before the next pair is produced; all other
+  values are parsed in one piece.
+  """
+  decoder = json.JSONDecoder(strict=False)
+  buf = ''
+  pos = 0
+  eof = False
+
+  def fill():
+    nonlocal buf, pos, eof
+    # read at least as much as we have buffered, so that values that span many
+    # chunks are only reparsed a logarithmic number of times
+    chunk = f.read(max(chunk_size, len(buf) - pos))
+    if not chunk:
+      eof = True
+      return False
+    buf = buf[pos:] + chunk
+    pos = 0
+    return True
+
+  def peek():
+    nonlocal pos
+    while True:
+      pos = json_whitespace.match(buf, pos).end()
+      if pos < len(buf) or not fill():
+        return buf[pos:pos+1]
+
+  def expect(c):
+    nonlocal pos
+    if peek() != c:
+      raise json.JSONDecodeError(f"Expecting '{c}'", buf, pos)
+    pos += 1
+
+  def value():
+    nonlocal pos
+    peek()
+    while True:
+      try:
+        v, end = decoder.raw_decode(buf, pos)
+      except json.JSONDecodeError:
+        if not fill():
+          raise
+        continue
+      # a number at the end of the buffer may continue in the next chunk
+      if buf[end:end+1] not in json_delimiters and not eof and fill():
+        continue
+      pos = end
+      return v
+
+  def elements():
+    nonlocal pos
+    expect('[')
+    if peek() == ']':
+      pos += 1
+      return
+    while True:
+      yield value()
+      c = peek()
+      pos += 1
+      if c == ']':
+        return
+      if c != ',':
+        raise json.JSONDecodeError("Expecting ',' delimiter", buf, pos - 1)
+
+  def end():
+    nonlocal pos
+    pos += 1
+    # as with `json.load`, only whitespace can follow the object, e.g. not the errors that Lean printed after it
+    if peek():
+      raise json.JSONDecodeError("Extra data", buf, pos)
+
+  expect('{')
+  if peek() == '}':
+    end()
+    return
+  while True:
+    key = value()
+    expect(':')
+    if key == 'decls':
+      decls = elements()
+      yield key, decls
+      for _ in decls:
+        pass
+    else:
+      yield key, value()
+    c = peek()
+    if c == '}':
+      end()
+      return
+    pos += 1
+    if c != ',':
+      raise json.JSONDecodeError("Expecting ',' delimiter", buf, pos - 1)
+
+# the fields of a declaration in `export.json` that are used by doc-gen
+decl_fields = (
+  'name', 'is_meta', 'args', 'type', 'doc_string', 'filename', 'line', 'attributes',
+  'noncomputable_reason', 'sorried', 'equations', 'kind', 'structure_fields', 'constructors',
+)
+decl_field_set = frozenset(decl_fields)
+
+def intern_efmt(f, interned):
+  """
+  Returns the efmt tree `f` as tuples, with equal subtrees replaced by a single shared copy from `interned`,
+  so that `linkify_efmt` renders each of them only once.
+  """
+  if isinstance(f, str):
+    return interned.setdefault(f, f)
+  # in reverse pre-order, the children of a node come before the node itself
+  nodes = [f]
+  for node in nodes:
+    if not isinstance(node[1], str):
+      nodes.append(node[1])
+    if len(node) > 2 and not isinstance(node[2], str):
+      nodes.append(node[2])
+  canonical = {}
+  for node in reversed(nodes):
+    kind = interned.setdefault(node[0], node[0])
+    a = node[1]
+    a = interned.setdefault(a, a) if isinstance(a, str) else canonical[id(a)]
+    # the interned nodes keep `kind`, `a` and `b` alive, so their ids identify the node;
+    # a single int takes less memory than a tuple of them
+    if len(node) > 2:
+      b = node[2]
+      b = interned.setdefault(b, b) if isinstance(b, str) else canonical[id(b)]
+      key = id(kind) << 128 | id(a) << 64 | id(b)
+      canonical[id(node)] = interned.get(key) or interned.setdefault(key, (kind, a, b))
+    else:
+      key = id(kind) << 128 | id(a) << 64
+      canonical[id(node)] = interned.get(key) or interned.setdefault(key, (kind, a))
+  return canonical[id(f)]
+
+class DeclArg(NamedTuple):
+  arg: tuple # an efmt tree
+  implicit: bool
+
+class Decl:
+  """
+  A declaration of `export.json`, keeping only the fields in `decl_fields`. Its efmt trees,
+  arguments, attributes and strings are shared with the other declarations through `interned`,
+  and its lists are tuples.
+
+  The templates read the fields as attributes; they can also be read as items, as in the dicts
+  that the declarations used to be.
+  """
+  __slots__ = decl_fields
+
+  def __init__(self, obj, interned):
+    def intern(s):
+      return s if s is None else interned.setdefault(s, s)
+    self.name = intern(obj['name'])
+    self.is_meta = obj['is_meta']
+    args = []
+    for arg in obj['args']:
+      f = intern_efmt(arg['arg'], interned)
+      args.append(interned.setdefault((DeclArg, id(f), arg['implicit']), DeclArg(f, arg['implicit'])))
+    self.args = tuple(args)
+    self.type = intern_efmt(obj['type'], interned)
+    self.doc_string = intern(obj['doc_string'])
+    self.filename = ImportName.of(obj['filename'])
+    self.line = obj['line']
+    attributes = tuple(map(intern, obj['attributes']))
+    self.attributes = interned.setdefault(attributes, attributes)
+    self.noncomputable_reason = intern(obj['noncomputable_reason'])
+    self.sorried = obj['sorried']
+    self.equations = tuple(intern_efmt(eqn, interned) for eqn in obj['equations'])
+    self.kind = intern(obj['kind'])
+    self.structure_fields = tuple((intern(name), intern_efmt(tp, interned)) for name, tp in obj['structure_fields'])
+    self.constructors = tuple((intern(name), intern_efmt(tp, interned)) for name, tp in obj['constructors'])
+
+  def __getitem__(self, key):
+    if key in decl_field_set:
+      return getattr(self, key)
+    raise KeyError(key)
+
+  def __contains__(self, key):
+    return key in decl_field_set
+
+  def as_dict(self):
+    return {key: getattr(self, key) for key in decl_fields}
+
 def load_json():
+  decls = {}
+  interned = {}
   try:
     with open('export.json', 'r', encoding='utf-8') as f:
-      decls = json.load(f, strict=False)
+      for key, value in stream_export_json(f):
+        if key == 'decls':
+          file_map, loc_map, decl_map, owner_map = separate_results(Decl(decl, interned) for decl in value)
+        else:
+          decls[key] = value
   except json.JSONDecodeError:
     print("json file is corrupt:\n")
     # The lean code might have echoed errors out into the json, print it so that we can see them
@@ -355,11 +1078,14 @@ def load_json():
       raw = f.read()
       print(raw)
     raise
-  file_map, loc_map = separate_results(decls['decls'])
   for entry in decls['tactic_docs']:
     if len(entry['tags']) == 0:
       entry['tags'] = ['untagged']
 
+  # the instances are listed by name, which can share the strings of the declarations
+  instances, instances_for = ({interned.setdefault(name, name): [interned.setdefault(i, i) for i in insts]
+    for name, insts in decls[key].items()} for key in ['instances', 'instances_for'])
+
   mod_docs = {ImportName.of(f): docs for f, docs in decls['mod_docs'].items()}
   # ensure the key is present for `default.lean` modules with no declarations
   for i_name in mod_docs:
@@ -367,7 +1093,7 @@ def load_json():
       continue  # this is doc-gen itself
     file_map[i_name]
 
-  return file_map, loc_map, decls['notes'], mod_docs, decls['instances'], decls['instances_for'], decls['tactic_docs']
+  return file_map, loc_map, decl_map, owner_map, decls['notes'], mod_docs, instances, instances_for, decls['tactic_docs']
 
 def linkify_core(decl_name, text, loc_map):
   if decl_name.startswith("\ue003"):
@@ -407,30 +1133,80 @@ def linkify_linked(string, loc_map):
     match[1] + linkify_core(match[0], match[2], loc_map) + match[3]
     for match in re.findall(r'\ue000(.+?)\ue001(\s*)(.*?)(\s*)\ue002|([^\ue000]+)', string))
 
-def linkify_efmt(f, loc_map):
-  def go(f):
-    if isinstance(f, str):
-      f = f.replace('\n', ' ')
+def linkify_efmt(f, loc_map, rendered = None):
+  # `rendered` can be shared between calls with the same `loc_map`: it maps leaf strings to their HTML,
+  # and the `id` of an `['n', ...]` node to the node and its HTML, which pays off after `intern_efmt`;
+  # it keeps growing as long as it is shared, see `filter_cache_entries`
+  if rendered is None:
+    rendered = {}
+  def leaf(f):
+    if f not in rendered:
       # f = f.replace(' ', '&nbsp;')
-      return linkify_linked(f, loc_map)
-    elif f[0] == 'n':
-      return f'<span class="fn">{go(f[1])}</span>'
-    elif f[0] == 'c':
-      return go(f[1]) + go(f[2])
-    else:
-      raise Exception('unknown efmt object')
-
-  return go(['n', f])
+      rendered[f] = linkify_linked(f.replace('\n', ' '), loc_map)
+    return rendered[f]
+
+  # each frame is an `['n', ...]` node, the HTML of its contents so far, and the subtrees left to render
+  frames = [(None, [], [f])]
+  while True:
+    group, parts, todo = frames[-1]
+    if todo:
+      f = todo.pop()
+      if isinstance(f, str):
+        parts.append(leaf(f))
+      elif f[0] == 'c':
+        todo.extend((f[2], f[1]))
+      elif f[0] == 'n':
+        cached = rendered.get(id(f))
+        if cached is not None and cached[0] is f:
+          parts.append(cached[1])
+        else:
+          frames.append((f, [], [f[1]]))
+      else:
+        raise Exception('unknown efmt object')
+      continue
+    html = '<span class="fn">' + ''.join(parts) + '</span>'
+    frames.pop()
+    if not frames:
+      return html
+    rendered[id(group)] = (group, html)
+    frames[-1][1].append(html)
 
 # store number of backref anchors and notes in each file
 num_backrefs = defaultdict(int)
 num_notes = defaultdict(int)
-
-def linkify_markdown(string: str, loc_map, bib) -> str:
+# when set, backrefs are collected here as (kind, key, backref) instead of being
+# added to `global_notes` and `bib`; see `write_module_page_in_worker`
+backref_log: Optional[list] = None
+
+def add_backref(kind, key, backref, bib):
+  if backref_log is not None:
+    backref_log.append((kind, key, backref))
+  elif kind == 'note':
+    global_notes[key].backrefs.append(backref)
+  else:
+    bib.entries[key].backrefs.append(backref)
+
+# Lean types are split into tokens at whitespace and brackets before linkifying
+type_token_separator = re.compile(r'([\s\[\]\(\)\{\}])')
+note_pattern = re.compile(r'Note \[(.*)\]', re.I)
+# inline declaration names and declaration names in highlighted Lean code snippets
+code_span_regex = re.compile(r'<code>(?P<code>[^<]+)</code>|<span class="n">(?P<span>[^<]+)</span>')
+code_span_tags = {'code': ('<code>', '</code>'), 'span': ('<span class="n">', '</span>')}
+# references (don't match if there are illegal characters for a BibTeX key,
+# cf. https://tex.stackexchange.com/a/408548)
+named_ref_regex = re.compile(r'\[([^\]]+)\]\s*\[([^{ },~#%\\]+)\]')
+standalone_ref_regex = re.compile(r'\[([^{ },~#%\\]+)\]')
+
+def linkify_markdown(string: str, loc_map, bib, linked_code = None) -> str:
+  # `linked_code` can be shared between calls with the same `loc_map`, see `filter_cache_entries`
+  if linked_code is None:
+    linked_code = {}
   def linkify_type(string: str):
-    splitstr = re.split(r'([\s\[\]\(\)\{\}])', string)
-    tks = map(lambda s: linkify(s, loc_map), splitstr)
-    return "".join(tks)
+    if string not in linked_code:
+      splitstr = type_token_separator.split(string)
+      tks = map(lambda s: linkify(s, loc_map), splitstr)
+      linked_code[string] = "".join(tks)
+    return linked_code[string]
 
   def backref_title(filename: str):
     parts = filename.split('/')
@@ -442,17 +1218,15 @@ def linkify_markdown(string: str, loc_map, bib) -> str:
     num_notes[current_filename] += 1
     backref_id = f'noteref{num_notes[current_filename]}'
     if current_project and current_project != 'test':
-      global_notes[key].backrefs.append(
-        (current_filename, backref_id, backref_title(current_filename))
-      )
+      add_backref('note', key,
+        (current_filename, backref_id, backref_title(current_filename)), bib)
     return backref_id
   def bib_backref(key: str) -> str:
     num_backrefs[current_filename] += 1
     backref_id = f'backref{num_backrefs[current_filename]}'
     if current_project and current_project != 'test':
-      bib.entries[key].backrefs.append(
-        (current_filename, backref_id, backref_title(current_filename))
-      )
+      add_backref('bib', key,
+        (current_filename, backref_id, backref_title(current_filename)), bib)
     return backref_id
 
   def linkify_note(body: str, note: str) -> str:
@@ -470,25 +1244,37 @@ def linkify_markdown(string: str, loc_map, bib) -> str:
       return f'<a id="{bib_backref(key)}" href="{site_root}references.html#{alpha_label}">[{alpha_label}]</a>'
     return body
 
-  # notes
-  string = re.compile(r'Note \[(.*)\]', re.I).sub(
-    lambda p: linkify_note(p.group(0), p.group(1)), string)
-  # inline declaration names
-  string = re.sub(r'<code>([^<]+)</code>',
-    lambda p: f'<code>{linkify_type(p.group(1))}</code>', string)
-  # declaration names in highlighted Lean code snippets
-  string = re.sub(r'<span class="n">([^<]+)</span>',
-    lambda p: f'<span class="n">{linkify_type(p.group(1))}</span>', string)
-  # references (don't match if there are illegal characters for a BibTeX key,
-  # cf. https://tex.stackexchange.com/a/408548)
-  string = re.sub(r'\[([^\]]+)\]\s*\[([^{ },~#%\\]+)\]',
-    lambda p: linkify_named_ref(p.group(0), p.group(1), p.group(2)), string)
-  string = re.sub(r'\[([^{ },~#%\\]+)\]',
-    lambda p: linkify_standalone_ref(p.group(0), p.group(1)), string)
+  # each rewrite is its own pass, as they can overlap: e.g. all named references are
+  # linked before the standalone ones; the checks skip the passes that cannot match
+  if ' [' in string:
+    string = note_pattern.sub(lambda p: linkify_note(p.group(0), p.group(1)), string)
+  if '<' in string:
+    string = code_span_regex.sub(lambda p: '{0}{2}{1}'.format(
+      *code_span_tags[p.lastgroup], linkify_type(p.group(p.lastgroup))), string)
+  if '[' in string:
+    string = named_ref_regex.sub(lambda p: linkify_named_ref(p.group(0), p.group(1), p.group(2)), string)
+    string = standalone_ref_regex.sub(lambda p: linkify_standalone_ref(p.group(0), p.group(1)), string)
   return string
 
 summary_renderer = PlaintextSummaryRenderer()
+
+@lru_cache(maxsize=None)
 def plaintext_summary(markdown, max_chars = 200):
+  """
+  The plain text of `markdown`, shortened to `max_chars` at a word boundary.
+
+  Long documents are first parsed up to a line: the blocks before the last one are also blocks of
+  the whole document, so if their text goes on past the word cut at `max_chars`, the rest is not needed.
+  """
+  cut = markdown.find('\n', 4 * max_chars) if len(markdown) > 4 * max_chars else -1
+  # link reference definitions (`[label]: url`) can be used above them, so these documents are parsed in full
+  if cut != -1 and ']:' not in markdown:
+    blocks = mistletoe.Document(markdown[:cut + 1]).children[:-1]
+    text = ''.join(summary_renderer.render(block) for block in blocks)
+    words = text.split()
+    # the position of the last space once `textwrap.shorten` collapsed the whitespace
+    if len(' '.join(words[:-1])) > max_chars:
+      return textwrap.shorten(text, width = max_chars, placeholder="…")
   text = summary_renderer.render(mistletoe.Document(markdown))
   return textwrap.shorten(text, width = max_chars, placeholder="…")
 
@@ -501,6 +1287,14 @@ def htmlify_name(n):
   return '.'.join([f'<span class="name">{ html.escape(part) }</span>' for part in n.split('.')])
 env.filters['htmlify_name'] = htmlify_name
 
+# the rendered `decl_header.j2` of each declaration by name, reused by `mk_export_db`
+decl_headers = {}
+
+def render_decl_header(decl):
+  header = decl_headers[decl['name']] = render_template('decl_header.j2', decl = decl)
+  return header
+env.globals['decl_header'] = render_decl_header
+
 # returns (pagetitle, intro_block), [(tactic_name, tactic_block)]
 def split_tactic_list(markdown):
   entries = re.findall(r'(?<=# )(.*)([\s\S]*?)(?=(##|\Z))', markdown)
@@ -534,7 +1328,7 @@ def write_pure_md_file(source, dest, name):
     body = convert_markdown(infile.read())
 
   with open_outfile(dest) as out:
-    out.write(env.get_template('pure_md.j2').render(
+    out.write(render_template('pure_md.j2',
       active_path = '',
       name = name,
       body = body,
@@ -545,37 +1339,82 @@ def mk_site_tree(partition: List[ImportName]):
   return mk_site_tree_core(filenames)
 
 def mk_site_tree_core(filenames, path=[]):
-  entries = []
-
-  for dirname in sorted(set(dirname for dirname, *rest in filenames if rest != [])):
-    new_path = path + [dirname]
-    entries.append({
-      "kind": "project" if not path else "dir",
-      "name": dirname,
-      "path": '/'.join(new_path[1:]),
-      "children": mk_site_tree_core([rest for dn, *rest in filenames if rest != [] and dn == dirname], new_path)
-    })
-
-  for filename in sorted(filename for filename, *rest in filenames if rest == []):
-    new_path = path + [filename]
-    entries.append({
-      "kind": "file",
-      "name": filename,
-      "path": '/'.join(new_path[1:]) + '.html',
-    })
-
-  return entries
-
-def setup_jinja_globals(file_map, loc_map, instances, instances_for, bib):
-  env.globals['import_graph'] = trace_deps(file_map)
+  # the directories of each node by name, and its files under the key `None`
+  tree = {}
+  for filename in filenames:
+    node = tree
+    for dirname in filename[:-1]:
+      node = node.setdefault(dirname, {})
+    node.setdefault(None, []).append(filename[-1])
+
+  def mk_entries(node, prefix, top):
+    entries = []
+    for dirname in sorted(dirname for dirname in node if dirname is not None):
+      entries.append({
+        "kind": "project" if top else "dir",
+        "name": dirname,
+        "path": '' if top else prefix + dirname,
+        "children": mk_entries(node[dirname], '' if top else prefix + dirname + '/', False)
+      })
+    for filename in sorted(node.get(None, [])):
+      entries.append({
+        "kind": "file",
+        "name": filename,
+        "path": ('' if top else prefix + filename) + '.html',
+      })
+    return entries
+
+  return mk_entries(tree, '/'.join(path[1:] + ['']), not path)
+
+# when set, the names looked up in `loc_map` by the filters are collected here; see `IncrementalBuild`
+link_log: Optional[set] = None
+
+class LinkLoggingMap(Mapping):
+  """ A read-only view of `loc_map` that adds the names looked up in it to `link_log` """
+  def __init__(self, loc_map):
+    self.loc_map = loc_map
+
+  def __getitem__(self, name):
+    if link_log is not None:
+      link_log.add(name)
+    return self.loc_map[name]
+
+  def __contains__(self, name):
+    if link_log is not None:
+      link_log.add(name)
+    return name in self.loc_map
+
+  def __iter__(self):
+    return iter(self.loc_map)
+
+  def __len__(self):
+    return len(self.loc_map)
+
+# the caches that the filters share between pages, set by `setup_jinja_globals`
+filter_caches = {}
+# the HTML kept by the filters grows with the size of the output (for the efmt subtrees of `linkify_efmt`,
+# times the depth of the trees), so each cache is dropped before a page once it has more entries than this
+filter_cache_entries = {'linkify_efmt': 1 << 16, 'convert_markdown': 1 << 16}
+
+def setup_jinja_globals(file_map, loc_map, instances, instances_for, bib, jobs = 1, cache_dir = None, deps_backend = 'lean', log_links = False, import_graph = None):
+  if log_links:
+    loc_map = LinkLoggingMap(loc_map)
+  if import_graph is None:
+    with phase('trace_deps'):
+      import_graph = trace_deps(file_map, jobs, cache_dir, deps_backend)
+  env.globals['import_graph'] = import_graph
   env.globals['site_tree'] = mk_site_tree(file_map)
   env.globals['instances'] = instances
   env.globals['instances_for'] = instances_for
   env.globals['import_options'] = lambda d, i: import_options(loc_map, d, i)
   env.filters['linkify'] = lambda x: linkify(x, loc_map)
-  env.filters['linkify_efmt'] = lambda x: linkify_efmt(x, loc_map)
-  env.filters['convert_markdown'] = lambda x: linkify_markdown(convert_markdown(x), loc_map, bib) # TODO: this is probably very broken
+  rendered_efmt = {}
+  env.filters['linkify_efmt'] = lambda x: linkify_efmt(x, loc_map, rendered_efmt)
+  linked_code = {}
+  env.filters['convert_markdown'] = lambda x: linkify_markdown(convert_markdown(x), loc_map, bib, linked_code) # TODO: this is probably very broken
   env.filters['link_to_decl'] = lambda x: link_to_decl(x, loc_map)
+  filter_caches.clear()
+  filter_caches.update(linkify_efmt = rendered_efmt, convert_markdown = linked_code)
   env.filters['plaintext_summary'] = lambda x: plaintext_summary(x)
   env.filters['tex'] = lambda x: clean_tex(x)
 
@@ -585,22 +1424,244 @@ current_filename: Optional[str] = None
 current_project: Optional[str] = None
 global_notes = {}
 GlobalNote = namedtuple('GlobalNote', ['md', 'backrefs'])
-def write_html_files(partition, loc_map, notes, mod_docs, instances, instances_for, tactic_docs, bib):
+
+class IncrementalBuild:
+  """
+  The manifest of `--incremental` runs, kept in the cache directory between runs.
+
+  For each module page, it records a hash of the data the page is rendered from,
+  the names the page looked up in `loc_map` and the backrefs it added.
+  A page is only written again if its data changed or one of these names
+  was added, removed or moved to another module. All pages are written again
+  if the templates, doc-gen, the site root, the notes or the references changed.
+  """
+  version = 1
+
+  def __init__(self, path, notes, bib, loc_map):
+    self.path = path
+    self.inputs = self.global_inputs(notes, bib)
+    self.locations = defaultdict(list)
+    for name, filename in loc_map.items():
+      self.locations[filename.url].append(name)
+    manifest = load_json_cache(path)
+    if manifest.get('version') != self.version or manifest.get('inputs') != self.inputs:
+      manifest = {}
+    self.old_pages = manifest.get('pages', {})
+    self.pages = {}
+    old_urls = {name: url for url, names in manifest.get('locations', {}).items() for name in names}
+    self.moved = {name for name, filename in loc_map.items() if old_urls.pop(name, None) != filename.url}
+    self.moved.update(old_urls)
+
+  @staticmethod
+  def global_inputs(notes, bib):
+    h = hashlib.sha256()
+    for template in sorted(env.loader.list_templates()):
+      h.update(env.loader.get_source(env, template)[0].encode())
+    with open(__file__, 'rb') as f:
+      h.update(f.read())
+    h.update(markdown_renderer_version().encode())
+    h.update(json.dumps([html_root, site_root, config.library_link_roots, canonical_roots,
+      sorted(name for name, _ in notes),
+      sorted((key, entry.alpha_label) for key, entry in bib.entries.items())]).encode())
+    return h.hexdigest()
+
+  def page_inputs(self, filename, decls, md):
+    import_graph = env.globals['import_graph']
+    instances, instances_for = env.globals['instances'], env.globals['instances_for']
+    names = [decl['name'] for decl in decls]
+    data = [decls, md,
+      sorted(str(other) for _, other in import_graph.out_edges(filename)),
+      sorted(str(other) for other, _ in import_graph.in_edges(filename)),
+      [instances.get(name) for name in names],
+      [instances_for.get(name) for name in names],
+      [instances_for.get('↥' + name) for name in names]]
+    return hashlib.sha256(json.dumps(data, default=lambda o: o.as_dict() if isinstance(o, Decl) else str(o)).encode()).hexdigest()
+
+  def fresh_page(self, filename, inputs):
+    """ The backrefs of a page that can be kept from the last run, or None if it must be written again """
+    page = self.old_pages.get(filename.url)
+    if (page is None or page['inputs'] != inputs or not self.moved.isdisjoint(page['links'])
+        or not os.path.exists(html_root + filename.url)):
+      return None
+    self.pages[filename.url] = page
+    return page['backrefs']
+
+  def add_page(self, filename, inputs, links, backrefs):
+    self.pages[filename.url] = {
+      'inputs': inputs,
+      # the whitespace and brackets between the tokens of code are looked up too
+      'links': [name for name in links if name.strip()],
+      'backrefs': backrefs,
+    }
+
+  def reuse_decl_headers(self, decls):
+    """ Copies the headers of `decls`, which belong to pages that were kept, from the last `export_db.json.gz` """
+    try:
+      with gzip.open(html_root + 'export_db.json.gz', 'rt', encoding='utf-8') as f:
+        export_db = json.load(f)
+    except (OSError, EOFError, json.JSONDecodeError):
+      return
+    for decl in decls:
+      entry = export_db.get(decl['name'])
+      if entry is not None:
+        decl_headers[decl['name']] = entry['decl_header_html']
+
+  def save(self):
+    write_json_cache(self.path, {
+      'version': self.version,
+      'inputs': self.inputs,
+      'locations': self.locations,
+      'pages': self.pages,
+    })
+
+def write_module_page(filename, decls, md):
+  global current_filename, current_project
+  if link_log is not None:
+    # otherwise the names looked up for an earlier page would not be logged for this one
+    for cache in filter_caches.values():
+      cache.clear()
+  else:
+    for name, cache in filter_caches.items():
+      if len(cache) > filter_cache_entries[name]:
+        cache.clear()
+  start = time.perf_counter()
+  with open_outfile(html_root + filename.url) as out:
+    current_project = filename.project
+    current_filename = filename.url
+
+    out.write(render_template('module.j2',
+      canonical_url = get_canonical_url(current_filename, project=filename.project),
+      active_path = filename.url,
+      filename = filename,
+      items = sorted(md + decls, key = lambda d: d['line']),
+      decl_names = sorted(d['name'] for d in decls),
+    ))
+  if profiler is not None:
+    profiler.pages.append((time.perf_counter() - start, filename.url))
+
+def write_module_page_logged(filename, decls, md, log_links):
+  """ Writes a module page, and returns the backrefs it adds and the names it looks up in `loc_map` """
+  global backref_log, link_log
+  backref_log = []
+  link_log = set() if log_links else None
+  try:
+    write_module_page(filename, decls, md)
+    return backref_log, link_log
+  finally:
+    backref_log = link_log = None
+
+# (partition, mod_docs, log_links), set before forking the worker processes
+worker_pages = None
+
+def write_module_page_in_worker(filename):
+  """
+  Render one module page in a worker process.
+
+  Returns the backrefs created while rendering, so that the parent process
+  can replay them in the same order as a serial run would have added them,
+  the declaration headers rendered for the page, and the names it looked up.
+  """
+  global decl_headers, output_log
+  partition, mod_docs, log_links = worker_pages
+  decl_headers = {}
+  output_log = {}
+  if profiler is not None:
+    # drop what the parent process had collected before forking
+    profiler.take_pages()
+  cache_stats = (markdown_cache.hits, markdown_cache.misses) if markdown_cache else (0, 0)
+  backrefs, links = write_module_page_logged(filename, partition[filename], mod_docs.get(filename, []), log_links)
+  if markdown_cache:
+    # the pool may stop this process at any time once all pages are done
+    markdown_cache.flush()
+    cache_stats = (markdown_cache.hits - cache_stats[0], markdown_cache.misses - cache_stats[1])
+  profile = profiler.take_pages() if profiler is not None else None
+  return backrefs, num_notes[filename.url], num_backrefs[filename.url], cache_stats, decl_headers, links, output_log, profile
+
+def write_module_pages(partition, mod_docs, bib, jobs, incremental = None):
+  global worker_pages
+  if jobs <= 1 and incremental is None:
+    for filename, decls in partition.items():
+      write_module_page(filename, decls, mod_docs.get(filename, []))
+    return
+
+  if incremental is not None:
+    inputs = {filename: incremental.page_inputs(filename, decls, mod_docs.get(filename, []))
+      for filename, decls in partition.items()}
+    fresh = {filename: incremental.fresh_page(filename, inputs[filename]) for filename in partition}
+    pages = [filename for filename in partition if fresh[filename] is None]
+    if len(pages) < len(partition):
+      incremental.reuse_decl_headers(decl for filename in partition if fresh[filename] is not None for decl in partition[filename])
+    print(f"write_module_pages: {len(pages)} / {len(partition)} module pages changed since the last incremental run")
+  else:
+    fresh = {}
+    pages = list(partition)
+
+  def collect(results):
+    for filename in partition:
+      if fresh.get(filename) is not None:
+        # the page was not written again, but its backrefs still belong in notes.html and references.html
+        keep_outfile(filename.url)
+        for kind, key, backref in fresh[filename]:
+          add_backref(kind, key, tuple(backref), bib)
+        continue
+      backrefs, links = next(results)
+      for kind, key, backref in backrefs:
+        add_backref(kind, key, backref, bib)
+      if incremental is not None:
+        incremental.add_page(filename, inputs[filename], links, backrefs)
+
+  if jobs <= 1:
+    collect(write_module_page_logged(filename, partition[filename], mod_docs.get(filename, []), True) for filename in pages)
+    return
+
+  def merge(results):
+    for filename, (backrefs, n_notes, n_backrefs, (hits, misses), headers, links, outputs, profile) in results:
+      num_notes[filename.url] = n_notes
+      num_backrefs[filename.url] = n_backrefs
+      decl_headers.update(headers)
+      output_log.update(outputs)
+      if profile is not None:
+        profiler.merge_pages(profile)
+      if markdown_cache:
+        markdown_cache.hits += hits
+        markdown_cache.misses += misses
+      yield backrefs, links
+
+  worker_pages = (partition, mod_docs, incremental is not None)
+  # probed here rather than in every worker
+  config.library_link_roots
+  if markdown_cache:
+    markdown_cache.disconnect()
+  # workers inherit the jinja environment and the maps from `load_json` by forking
+  with multiprocessing.get_context('fork').Pool(jobs) as pool:
+    results = pool.imap(write_module_page_in_worker, pages, chunksize = 16)
+    collect(merge(zip(pages, results)))
+  worker_pages = None
+
+def write_html_files(partition, loc_map, notes, mod_docs, instances, instances_for, tactic_docs, bib, jobs = 1, incremental = None):
   global current_filename, current_project
   for note_name, note_markdown in notes:
     global_notes[note_name] = GlobalNote(note_markdown, [])
 
+  # the library part of the navbar, which nav.js loads into every page
+  with open_outfile('library_nav.html') as out:
+    out.write(render_template('library_nav.j2'))
+
   with open_outfile('index.html') as out:
     current_filename = 'index.html'
     current_project = None
-    out.write(env.get_template('index.j2').render(
+    out.write(render_template('index.j2',
       canonical_url = get_canonical_url(current_filename),
-      active_path=''))
+      active_path='',
+      mathlib_github_root = config.mathlib_github_root,
+      mathlib_commit = config.mathlib_commit,
+      lean_commit = config.lean_commit,
+      docgen_commit = config.docgen_commit))
 
   with open_outfile('404.html') as out:
     current_filename = '404.html'
     current_project = None
-    out.write(env.get_template('404.j2').render(
+    out.write(render_template('404.j2',
       canonical_url = None,
       active_path=''))
 
@@ -610,48 +1671,38 @@ def write_html_files(partition, loc_map, notes, mod_docs, instances, instances_f
     entries = [e for e in tactic_docs if e['category'] == kind]
     with open_outfile(filename + '.html') as out:
       current_filename = filename + '.html'
-      out.write(env.get_template(filename + '.j2').render(
+      out.write(render_template(filename + '.j2',
         canonical_url = get_canonical_url(current_filename),
         active_path='',
         entries = sorted(entries, key = lambda n: n['name']),
         tagset = sorted(set(t for e in entries for t in e['tags']))))
 
   with open_outfile('foundational_types.html') as out:
-      out.write(env.get_template('foundational_types.j2').render(
+      out.write(render_template('foundational_types.j2',
         canonical_url = get_canonical_url(current_filename),
         active_path='',
         instances_for=instances_for))
 
-  for filename, decls in partition.items():
-    md = mod_docs.get(filename, [])
-    with open_outfile(html_root + filename.url) as out:
-      current_project = filename.project
-      current_filename = filename.url
-
-      out.write(env.get_template('module.j2').render(
-        canonical_url = get_canonical_url(current_filename, project=filename.project),
-        active_path = filename.url,
-        filename = filename,
-        items = sorted(md + decls, key = lambda d: d['line']),
-        decl_names = sorted(d['name'] for d in decls),
-      ))
-
-  current_project = 'extra'
-  for (filename, displayname, source, _) in extra_doc_files:
-    current_filename = filename + '.html'
-    write_pure_md_file(local_lean_root + source, filename + '.html', displayname)
-
-  current_project = 'test'
-  for (filename, displayname, source) in test_doc_files:
-    current_filename = filename + '.html'
-    write_pure_md_file(source, filename + '.html', displayname)
+  with phase('write_module_pages'):
+    write_module_pages(partition, mod_docs, bib, jobs, incremental)
+
+  with phase('write_pure_md_files'):
+    current_project = 'extra'
+    for (filename, displayname, source, _) in extra_doc_files:
+      current_filename = filename + '.html'
+      write_pure_md_file(local_lean_root + source, filename + '.html', displayname)
+
+    current_project = 'test'
+    for (filename, displayname, source) in test_doc_files:
+      current_filename = filename + '.html'
+      write_pure_md_file(source, filename + '.html', displayname)
 
   # generate notes.html and references.html last
   # so that we can add backrefs
   with open_outfile('notes.html') as out:
     current_project = 'docs'
     current_filename = 'notes.html'
-    out.write(env.get_template('notes.j2').render(
+    out.write(render_template('notes.j2',
       canonical_url = get_canonical_url(current_filename),
       active_path='',
       notes = sorted(global_notes.items(), key = lambda n: n[0])))
@@ -659,7 +1710,7 @@ def write_html_files(partition, loc_map, notes, mod_docs, instances, instances_f
   with open_outfile('references.html') as out:
     current_project = 'docs'
     current_filename = 'references.html'
-    out.write(env.get_template('references.j2').render(
+    out.write(render_template('references.j2',
       canonical_url = get_canonical_url(current_filename),
       active_path='',
       entries = sorted(bib.entries.items(), key = lambda e: e[1].alpha_label)))
@@ -676,13 +1727,13 @@ def write_site_map(partition):
     for (filename, _, _, _) in extra_doc_files:
       out.write(site_root + filename + '.html\n')
 
-def write_docs_redirect(decl_name, decl_loc, file_map):
-  decl = next((d for d in file_map[decl_loc] if d['name'] == decl_name), None)
+def write_docs_redirect(decl_name, decl_loc, decl_map):
+  decl = decl_map[decl_loc].get(decl_name)
   with open_outfile(f'find/{decl_name}/index.html') as out:
-    out.write(env.get_template('find.j2').render(decl_name=decl_name, decl_loc=decl_loc, decl=decl))
+    out.write(render_template('find.j2', decl_name=decl_name, decl_loc=decl_loc, decl=decl))
 
-def write_src_redirect(decl_name, decl_loc, file_map):
-  url = library_link_from_decl_name(decl_name, decl_loc, file_map)
+def write_src_redirect(decl_name, decl_loc, owner_map):
+  url = library_link_from_decl_name(decl_name, decl_loc, owner_map)
   with open_outfile(f'find/{decl_name}/src/index.html') as out:
     out.write(f"""<script src="{site_root}add_commit.js"></script>
 <script>redirectTo("{url}");</script>
@@ -709,43 +1760,85 @@ function redirectTo(tgt) {
 }
 """)
 
-def write_redirects(loc_map, file_map):
+def write_redirects(loc_map, decl_map, owner_map):
   for decl_name in loc_map:
     if (decl_name == 'con' or decl_name.startswith('con.')) and sys.platform == 'win32':
       continue  # can't write these files on windows
-    write_docs_redirect(decl_name, loc_map[decl_name], file_map)
-    write_src_redirect(decl_name, loc_map[decl_name], file_map)
+    write_docs_redirect(decl_name, loc_map[decl_name], decl_map)
+    write_src_redirect(decl_name, loc_map[decl_name], owner_map)
+
+# must agree with `findShardCount` in find.js
+find_shard_count = 256
+
+def fnv1a(string: str) -> int:
+  """ The 32-bit FNV-1a hash of the UTF-16 code units of `string`, as computed by `fnv1a` in search.js (also used by find.js) """
+  h = 0x811c9dc5
+  utf16 = 'utf-16-le' if sys.byteorder == 'little' else 'utf-16-be'
+  for unit in memoryview(string.encode(utf16)).cast('H'):
+    h = ((h ^ unit) * 0x01000193) & 0xffffffff
+  return h
+
+def find_shard(decl_name: str) -> int:
+  return fnv1a(decl_name) % find_shard_count
+
+def write_find_shards(loc_map, owner_map):
+  """
+  Replaces `write_redirects`: instead of two pages for every declaration, write
+  `find_shards/<n>.json`, mapping each name to the index of its module in a
+  per-shard list of (page url, source url), and the line of its source.
+  The 404 page resolves `find/<decl>` and `find/<decl>/src` URLs with find.js.
+  """
+  shards = [{'modules': [], 'decls': {}} for _ in range(find_shard_count)]
+  module_indices = [{} for _ in range(find_shard_count)]
+  for decl_name, decl_loc in loc_map.items():
+    n = find_shard(decl_name)
+    try:
+      module_index = module_indices[n][decl_loc]
+    except KeyError:
+      module_index = module_indices[n][decl_loc] = len(shards[n]['modules'])
+      shards[n]['modules'].append([decl_loc.url, library_link(decl_loc)])
+    line = owner_of_decl_name(decl_name, decl_loc, owner_map)['line']
+    shards[n]['decls'][decl_name] = [module_index, line]
+
+  for n, shard in enumerate(shards):
+    with open_outfile(f'find_shards/{n}.json') as out:
+      json.dump(shard, out, ensure_ascii=False, separators=(',', ':'))
 
 def copy_css_and_js(path, use_symlinks):
   def cp(a, b):
-    # always remove destination, in case we used -l before
-    # and now want to copy the file
+    if not use_symlinks:
+      # replaces the symlink if we used -l before
+      copy_outfile(a, b)
+      return
+    target = os.path.relpath(a, os.path.dirname(b))
+    if os.path.islink(b) and os.readlink(b) == target:
+      output_log[os.path.relpath(b, path)] = 'unchanged'
+      return
+    output_log[os.path.relpath(b, path)] = 'changed' if os.path.lexists(b) else 'added'
     try:
       os.remove(b)
     except FileNotFoundError:
       pass
-    if use_symlinks:
-      os.symlink(os.path.relpath(a, os.path.dirname(b)), b)
-    else:
-      shutil.copyfile(a, b)
+    os.symlink(target, b)
 
   cp('style.css', path+'style.css')
   cp('pygments.css', path+'pygments.css')
   cp('pygments-dark.css', path+'pygments-dark.css')
   cp('nav.js', path+'nav.js')
   cp('search.js', path+'search.js')
+  cp('find.js', path+'find.js')
   cp('color_scheme.js', path+'color_scheme.js')
   cp('STIXTwoMath.woff2', path+'STIXTwoMath.woff2')
   cp('STIXlicense.txt', path+'STIXlicense.txt')
-  write_add_commit_js(url_rewrites)
+  write_add_commit_js(config.url_rewrites)
 
 def copy_yaml_bib_files(path):
   for fn in ['100.yaml', 'undergrad.yaml', 'overview.yaml', 'references.bib']:
-    shutil.copyfile(f'{local_lean_root}docs/{fn}', path+fn)
+    copy_outfile(f'{local_lean_root}docs/{fn}', path+fn)
 
 def copy_static_files(path):
   for filename in glob.glob(os.path.join(root, 'static', '*.*')):
-    shutil.copy(filename, path)
+    copy_outfile(filename, path + os.path.basename(filename))
 
 def write_decl_txt(loc_map):
   # it's not a bitmap, but apparently this tricks Github Pages / nginx into gzipping it
@@ -772,21 +1865,89 @@ def mk_export_map_entry(decl_name, filename, kind, is_meta, line, args, tp):
           'docs_link': f'{site_root}{filename.url}#{decl_name}'}
 
 def mk_export_db(file_map):
-  export_db = {}
-  for _, decls in file_map.items():
-    for obj in decls:
-      export_db[obj['name']] = mk_export_map_entry(obj['name'], obj['filename'], obj['kind'], obj['is_meta'], obj['line'], obj['args'], obj['type'])
-      export_db[obj['name']]['decl_header_html'] = env.get_template('decl_header.j2').render(decl=obj)
-      for (cstr_name, tp) in obj['constructors']:
-        export_db[cstr_name] = mk_export_map_entry(cstr_name, obj['filename'], obj['kind'], obj['is_meta'], obj['line'], [], tp)
-      for (sf_name, tp) in obj['structure_fields']:
-        export_db[sf_name] = mk_export_map_entry(sf_name, obj['filename'],  obj['kind'], obj['is_meta'], obj['line'], [], tp)
-  return export_db
-
-def write_export_db(export_db):
-  json_str = json.dumps(export_db)
-  with gzip.GzipFile(html_root + 'export_db.json.gz', 'w') as zout:
-    zout.write(json_str.encode('utf-8'))
+  """
+  Yields `(filename, name, entry)` for each entry of `export_db.json.gz`, in order.
+  A structure field is often also a declaration, and as in a dict, such a name keeps
+  the place of its first entry but gets its last one.
+  """
+  def names():
+    for filename, decls in file_map.items():
+      for obj in decls:
+        yield filename, obj['name'], obj, None
+        for (cstr_name, tp) in obj['constructors']:
+          yield filename, cstr_name, obj, tp
+        for (sf_name, tp) in obj['structure_fields']:
+          yield filename, sf_name, obj, tp
+
+  seen, last = set(), {}
+  for _, name, obj, tp in names():
+    if name in seen:
+      last[name] = obj, tp
+    seen.add(name)
+  del seen
+
+  written = set()
+  for filename, name, obj, tp in names():
+    if name in last:
+      if name in written: continue
+      written.add(name)
+      obj, tp = last[name]
+    if tp is None:
+      entry = mk_export_map_entry(name, obj['filename'], obj['kind'], obj['is_meta'], obj['line'], obj['args'], obj['type'])
+      # the header was normally rendered already, for the module page
+      header = decl_headers.get(name)
+      entry['decl_header_html'] = header if header is not None else render_decl_header(obj)
+    else:
+      entry = mk_export_map_entry(name, obj['filename'], obj['kind'], obj['is_meta'], obj['line'], [], tp)
+    yield filename, name, entry
+
+class GzipJsonObjectWriter:
+  """ Writes a JSON object to a gzip file one entry at a time, as `json.dumps` would format it """
+  def __init__(self, path, compresslevel):
+    self.file = open_outfile(path, 'wb')
+    # without a timestamp, so that the same entries give the same file
+    self.out = io.TextIOWrapper(gzip.GzipFile(fileobj=self.file, mode='wb', compresslevel=compresslevel, mtime=0), encoding='utf-8')
+    self.sep = '{'
+
+  def write(self, key, value):
+    self.out.write(self.sep)
+    self.out.write(json.dumps(key))
+    self.out.write(': ')
+    self.out.write(json.dumps(value))
+    self.sep = ', '
+
+  def close(self):
+    self.out.write('{}' if self.sep == '{' else '}')
+    self.out.close()
+    self.file.close()
+
+def export_db_shard(filename, shard_by):
+  if shard_by == 'project':
+    return f'export_db/{filename.project}.json.gz'
+  else:
+    return f'export_db/{filename.project}/{filename.url[:-len(".html")]}.json.gz'
+
+def write_export_db(entries, shard_by = None, compresslevel = 9):
+  """
+  Streams the entries yielded by `mk_export_db` into `export_db.json.gz`,
+  and with `shard_by` also into one file per project or module under `export_db/`.
+  """
+  db = GzipJsonObjectWriter(html_root + 'export_db.json.gz', compresslevel)
+  shards = {}
+  for filename, name, entry in entries:
+    db.write(name, entry)
+    if shard_by:
+      shard = export_db_shard(filename, shard_by)
+      if shard not in shards:
+        if shard_by == 'module':
+          # the entries of a module are consecutive
+          for other in shards.values(): other.close()
+          shards.clear()
+        shards[shard] = GzipJsonObjectWriter(html_root + shard, compresslevel)
+      shards[shard].write(name, entry)
+  db.close()
+  for shard in shards.values():
+    shard.close()
 
 def mk_export_searchable_map_entry(proj, filename_name, name, description, kind = '', attributes = []):
   return {
@@ -827,15 +1988,64 @@ def write_export_searchable_db(searchable_data):
   with open_outfile('searchable_data.bmp') as out:
     out.write(json_str)
 
+# must agree with `searchShardCount` in search.js
+search_shard_count = 64
+# docstrings are searched by their words, cf. `searchWord` in search.js
+search_word = re.compile(r'\w+')
+
+def search_shard(word: str) -> int:
+  # all words with the same first two characters (not UTF-16 code units, cf. `searchShard` in search.js)
+  # are in the same shard
+  return fnv1a(word[:2]) % search_shard_count
+
+def write_search_index(searchable_data):
+  """
+  Writes the index that search.js uses instead of `searchable_data.bmp`:
+  `search_index/names.json` holds the name and project of every entry, and
+  `search_index/<n>.json` maps the words of the docstrings in shard `n` to
+  the (indices of the) entries whose docstring contains them.
+  """
+  names = {'projects': [], 'names': [], 'p': []}
+  projects = {}
+  shards = [defaultdict(list) for _ in range(search_shard_count)]
+  # constructors and structure fields share the docstring of their declaration
+  doc_words = {}
+  for i, entry in enumerate(searchable_data):
+    if entry['p'] not in projects:
+      projects[entry['p']] = len(names['projects'])
+      names['projects'].append(entry['p'])
+    names['names'].append(entry['name'])
+    names['p'].append(projects[entry['p']])
+    doc = entry['description']
+    if doc not in doc_words:
+      doc_words[doc] = dict.fromkeys(search_word.findall(doc.lower()))
+    for word in doc_words[doc]:
+      shards[search_shard(word)][word].append(i)
+
+  with open_outfile('search_index/names.json') as out:
+    json.dump(names, out, ensure_ascii=False, separators=(',', ':'))
+  for n, shard in enumerate(shards):
+    with open_outfile(f'search_index/{n}.json') as out:
+      json.dump(shard, out, ensure_ascii=False, separators=(',', ':'))
+
 def main():
-  global html_root, local_lean_root, site_root
+  global html_root, local_lean_root, site_root, markdown_cache, profiler
   cl_args = parser.parse_args()
+  if cl_args.incremental and not cl_args.cache_dir:
+    parser.error('--incremental requires --cache-dir')
+  if cl_args.profile:
+    profiler = Profiler()
+  for key in ['lean_commit', 'lean_path', 'docgen_commit']:
+    if getattr(cl_args, key):
+      setattr(config, key, getattr(cl_args, key))
+  if cl_args.config:
+    config.load(cl_args.config)
+  if cl_args.save_config:
+    config.save(cl_args.save_config)
 
   # path to put generated html
   html_root = os.path.join(root, cl_args.t if cl_args.t else 'html') + '/'
 
-  # TODO: make sure nothing is left in html_root
-
   # root of the site, for display purposes.
   # override this setting with the `-w` flag.
   site_root = cl_args.w if cl_args.w else '/'
@@ -845,19 +2055,63 @@ def main():
 
   env.globals['site_root'] = site_root
 
-  bib = parse_bib_file(f'{local_lean_root}docs/references.bib')
-  file_map, loc_map, notes, mod_docs, instances, instances_for, tactic_docs = load_json()
-  setup_jinja_globals(file_map, loc_map, instances, instances_for, bib)
-  write_import_gexf(file_map)
-  write_decl_txt(loc_map)
-  write_html_files(file_map, loc_map, notes, mod_docs, instances, instances_for, tactic_docs, bib)
-  write_redirects(loc_map, file_map)
-  copy_css_and_js(html_root, use_symlinks=cl_args.l)
-  copy_yaml_bib_files(html_root)
-  copy_static_files(html_root)
-  write_export_db(mk_export_db(file_map))
-  write_export_searchable_db(mk_export_searchable_db(file_map, tactic_docs))
+  if cl_args.cache_dir:
+    markdown_cache = MarkdownCache(os.path.join(cl_args.cache_dir, 'markdown.sqlite'),
+      cl_args.markdown_cache_size * 2**20)
+
+  with phase('parse_bib_file'):
+    bib = parse_bib_file(f'{local_lean_root}docs/references.bib')
+  with phase('load_json'):
+    file_map, loc_map, decl_map, owner_map, notes, mod_docs, instances, instances_for, tactic_docs = load_json()
+  if cl_args.check_deps:
+    with phase('check_deps'):
+      check_deps(file_map, cl_args.check_deps, jobs=cl_args.jobs)
+  incremental = None
+  if cl_args.incremental:
+    incremental = IncrementalBuild(os.path.join(cl_args.cache_dir, 'incremental.json'), notes, bib, loc_map)
+  with phase('setup_jinja_globals'):
+    setup_jinja_globals(file_map, loc_map, instances, instances_for, bib,
+      jobs=cl_args.jobs, cache_dir=cl_args.cache_dir, deps_backend=cl_args.deps_backend, log_links=cl_args.incremental)
+  with phase('write_import_gexf'):
+    write_import_gexf(file_map)
+  with phase('write_decl_txt'):
+    write_decl_txt(loc_map)
+  with phase('write_html_files'):
+    write_html_files(file_map, loc_map, notes, mod_docs, instances, instances_for, tactic_docs, bib, jobs=cl_args.jobs, incremental=incremental)
+  with phase('write_redirects'):
+    if cl_args.redirects == 'shards':
+      write_find_shards(loc_map, owner_map)
+    else:
+      write_redirects(loc_map, decl_map, owner_map)
+  with phase('copy_files'):
+    copy_css_and_js(html_root, use_symlinks=cl_args.l)
+    copy_yaml_bib_files(html_root)
+    copy_static_files(html_root)
+  with phase('write_export_db'):
+    write_export_db(mk_export_db(file_map), cl_args.export_db_shards, cl_args.export_db_compresslevel)
+  with phase('write_export_searchable_db'):
+    searchable_data = mk_export_searchable_db(file_map, tactic_docs)
+    write_export_searchable_db(searchable_data)
+    write_search_index(searchable_data)
   write_site_map(file_map)
+  if incremental:
+    incremental.save()
+  with phase('finish_output'):
+    changes = finish_output(clean=cl_args.clean)
+  print(f"finish_output: {len(changes['added'])} files added, {len(changes['changed'])} changed, "
+    f"{len(changes['removed'])} {'removed' if cl_args.clean else 'left from earlier runs'}")
+  if cl_args.changes:
+    with open(cl_args.changes, 'w', encoding='utf-8') as f:
+      json.dump(changes, f, indent=1)
+  if markdown_cache:
+    markdown_cache.close()
+  if profiler:
+    report = profiler.report(cl_args.profile_modules)
+    with open(cl_args.profile, 'w', encoding='utf-8') as f:
+      json.dump(report, f, indent=1)
+    for p in report['phases']:
+      rss = '' if p['max_rss_mb'] is None else f", {p['max_rss_mb']:.0f}MB max RSS"
+      print(f"profile: {p['phase']}: {p['wall']:.2f}s wall, {p['cpu']:.2f}s CPU{rss}")
 
 if __name__ == '__main__':
   main()
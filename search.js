@@ -22,30 +22,109 @@ function matchCaseSensitive(declName, lowerDeclName, pat) {
     }
 }
 
-function loadDecls(searchableDataCnt) {
-    return searchableDataCnt.map(({p, name, description}) => [name, name.toLowerCase(), description.toLowerCase(), p])
+// must agree with `search_shard_count` in print_docs.py
+const searchShardCount = 64;
+// must agree with `search_word` in print_docs.py
+const searchWord = /[\p{L}\p{N}_]+/gu;
+
+function fnv1a(s) {
+    // 32-bit FNV-1a hash of the UTF-16 code units, as in `fnv1a` in print_docs.py
+    let h = 0x811c9dc5;
+    for (let i = 0; i < s.length; i++) {
+        h = Math.imul(h ^ s.charCodeAt(i), 0x01000193) >>> 0;
+    }
+    return h;
+}
+
+// the first two characters of a word, counted as in Python: `slice` would count UTF-16 code units,
+// and only take the first character of words starting with e.g. 𝕜
+function wordPrefix(word) {
+    return Array.from(word).slice(0, 2).join('');
+}
+
+// must agree with `search_shard` in print_docs.py
+function searchShard(word) {
+    return fnv1a(wordPrefix(word)) % searchShardCount;
+}
+
+// the characters of a string, hashed to a 32-bit mask;
+// a name can only match a pattern if its mask contains the one of the pattern
+function charMask(s) {
+    let mask = 0;
+    for (let i = 0; i < s.length; i++) {
+        mask |= 1 << (s.charCodeAt(i) & 31);
+    }
+    return mask;
+}
+
+// the lowercase docstrings, from `searchable_data.bmp`, for the parts of a pattern that the index cannot match
+function loadDocstrings(searchableData) {
+    return searchableData.map(({description}) => description.toLowerCase());
 }
 
-function getMatches(decls, pat, maxResults = 30) {
-    const lowerPats = pat.toLowerCase().split(/\s/g);
+function loadDecls({projects, names, p}) {
+    return names.map((name, i) => {
+        const lowerName = name.toLowerCase();
+        return [name, lowerName, charMask(name) | charMask(lowerName), projects[p[i]]];
+    });
+}
+
+// the indices of the declarations whose docstring matches each whitespace-separated part of `pat`:
+// a part that is a word, as the start of a word of the docstring, using the index, and any other part
+// (a single character, or e.g. `a+b`) as a substring of the docstring, which needs all of them
+async function getDocMatches({loadDocShard, loadDocs}, pat) {
+    let matches;
+    const substrings = [];
+    for (const part of pat.toLowerCase().split(/\s+/)) {
+        if (!part) continue;
+        const words = part.match(searchWord) || [];
+        if (words.length !== 1 || words[0] !== part || Array.from(part).length < 2) {
+            substrings.push(part);
+            continue;
+        }
+        const shard = await loadDocShard(searchShard(part));
+        const wordMatches = new Set();
+        for (const docWord in shard) {
+            if (docWord.startsWith(part)) {
+                for (const i of shard[docWord]) wordMatches.add(i);
+            }
+        }
+        matches = matches ? new Set([...matches].filter((i) => wordMatches.has(i))) : wordMatches;
+        if (!matches.size) return matches;
+    }
+    if (substrings.length) {
+        const docs = await loadDocs();
+        matches = new Set([...(matches || docs.keys())].filter((i) => substrings.every((s) => docs[i].includes(s))));
+    }
+    return matches || new Set();
+}
+
+async function getMatches(index, pat, maxResults = 30) {
     const patNoSpaces = pat.replace(/\s/g, '');
+    const patMask = charMask(patNoSpaces);
+    const docMatches = pat.length > 3 ? await getDocMatches(index, pat) : new Set();
     const results = [];
-    for (const [decl, lowerDecl, lowerDoc, proj] of decls) {
-        let err = matchCaseSensitive(decl, lowerDecl, patNoSpaces);
+    index.decls.forEach(([decl, lowerDecl, mask, proj], i) => {
+        let err = (mask & patMask) === patMask ? matchCaseSensitive(decl, lowerDecl, patNoSpaces) : undefined;
 
-        // match all words as substrings of docstring
-        if (!(err < 3) && pat.length > 3 && lowerPats.every(l => lowerDoc.indexOf(l) != -1)) {
+        // match the words and other parts of the pattern in the docstring
+        if (!(err < 3) && docMatches.has(i)) {
             err = 3;
         }
 
         if (err !== undefined) {
             results.push({decl, err, proj});
         }
-    }
+    });
     return results.sort(({err: a}, {err: b}) => a - b).slice(0, maxResults);
 }
 
 if (typeof process === 'object') { // NodeJS
-    const data = loadDecls(JSON.parse(require('fs').readFileSync('searchable_data.bmp').toString()));
-    console.log(getMatches(data, process.argv[2] || 'ltltle'));
-}
\ No newline at end of file
+    const fs = require('fs');
+    const index = {
+        decls: loadDecls(JSON.parse(fs.readFileSync('search_index/names.json').toString())),
+        loadDocShard: async (n) => JSON.parse(fs.readFileSync(`search_index/${n}.json`).toString()),
+        loadDocs: async () => loadDocstrings(JSON.parse(fs.readFileSync('searchable_data.bmp').toString())),
+    };
+    getMatches(index, process.argv[2] || 'ltltle').then(console.log);
+}
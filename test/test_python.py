@@ -1,11 +1,39 @@
+import collections
+import gzip
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import subprocess
 import sys
 import textwrap
+import types
 from pathlib import Path
 
+import networkx as nx
+import pytest
+
 # can be removed if we make `print_docs` an installable module
 sys.path.append(str(Path(__file__).parent.parent)) 
 import print_docs
 
+def eval_js(scripts, expr):
+    """ Evaluates `expr` with node, after the `scripts` of doc-gen as a page loads them, and awaits it """
+    root = Path(__file__).parent.parent
+    code = textwrap.dedent(f'''
+        const vm = require('vm'), fs = require('fs');
+        const context = vm.createContext({{URL, siteRoot: '/', window: {{location: new URL('http://localhost/')}}}});
+        for (const script of {json.dumps([str(root / script) for script in scripts])}) {{
+            vm.runInContext(fs.readFileSync(script, 'utf8'), context);
+        }}
+        Promise.resolve(vm.runInContext({json.dumps(expr)}, context)).then((result) => console.log(JSON.stringify(result)));
+    ''')
+    return json.loads(subprocess.check_output(['node', '-e', code]))
+
 def test_plaintext_summary():
     s = textwrap.dedent("""
     # Quaternions
@@ -38,3 +66,649 @@ def test_plaintext_summary():
         "for any commutative ring `R`; `domain ℍ[R]` : for a linear ordered commutative ring `R`; "
         "`division_algebra ℍ[R]` : for a linear ordered field `R`.")
     assert print_docs.plaintext_summary(s, max_chars=sys.maxsize) == expected
+    # only the start of long documents is parsed
+    assert print_docs.plaintext_summary(s * 3) == textwrap.shorten(expected, width=200, placeholder="…")
+    assert print_docs.plaintext_summary(s + '\n[link]: https://example.com') == textwrap.shorten(expected, width=200, placeholder="…")
+
+def test_import_names():
+    s = textwrap.dedent("""
+    /-
+    Copyright (c) 2018. /- nested -/ import not.this
+    -/
+    import data.nat.basic -- a comment
+      algebra.group.defs
+    import .sibling ..parent.child
+
+    /-!
+    # Title
+    -/
+    import not.this.either
+    """)
+    assert print_docs.import_names(s) == [
+        'init', 'data.nat.basic', 'algebra.group.defs', '.sibling', '..parent.child']
+    assert print_docs.import_names("prelude\nimport init.core\nuniverses u v\n") == ['init.core']
+    assert print_docs.import_names("import tactic\nopen nat\n") == ['init', 'tactic']
+
+def test_raw_url():
+    def urls(s):
+        return [m.group(1) for m in print_docs.mistletoe_renderer.RawUrl.find(s)]
+    assert urls('see https://example.com/a?b=c#d, or www.example.org.') == ['https://example.com/a?b=c#d', 'www.example.org.']
+    # not in Markdown links, brackets or HTML tags
+    assert urls('[docs](https://example.com/docs) and (https://example.com/x) but https://example.com/y') == ['https://example.com/y']
+    assert urls('<a href="https://example.com/a">https://example.com/a</a> https://example.com/b <br/>') == ['https://example.com/b']
+    assert urls('mail user@example.com or ftp://user:pw@host.org:[0-9]]/path') == ['user@example.com', 'ftp://user:pw@host.org:[0-9]]/path']
+    assert urls('abc:abc:abc') == ['abc:abc']
+    assert urls('a' * 50 + ' aaa.b@c') == ['b@c']
+    assert print_docs.markdown_renderer.render_md('See https://example.com.') == '<p>See <a href="https://example.com.">https://example.com.</a></p>\n'
+
+# `mathjax_editing.remove_math` as it was before its split walk was sped up
+split_regex = re.compile(r'(\$\$?|\\(?:begin|end)\{[a-z]*\*?\}|\\[\\{}$]|[{}]|(?:\n\s*)+|@@\d+@@|`+)', re.I)
+
+def remove_math_split(text, inline):
+    def process_math(i, j):
+        nonlocal blocks, start, end, last
+        block = "".join(blocks[i:j+1])
+        if indent:
+            block = re.sub(r'\n    ', '\n', block)
+        while j > i:
+            blocks[j] = ""
+            j -= 1
+        blocks[i] = f"@@{len(math)}@@"
+        math.append(block)
+        start = None
+        end = None
+        last = None
+
+    start = None
+    end = None
+    last = None
+    indent = None
+    braces = None
+    math = []
+    blocks = re.split(split_regex, re.sub(r'\r\n?', "\n", text))
+    i = 1
+    m = len(blocks)
+    while i < m:
+        block = blocks[i]
+        if block[0] == "@":
+            blocks[i] = f"@@{len(math)}@@"
+            math.append(block)
+        elif start:
+            if block == end:
+                if braces > 0:
+                    last = i
+                elif braces == 0:
+                    process_math(start, i)
+                else:
+                    start = None
+                    end = None
+                    last = None
+            elif re.search(r'\n.*\n', block) or i + 2 >= m:
+                if last:
+                    i = last
+                    if braces >= 0:
+                        process_math(start, i)
+                start = None
+                end = None
+                last = None
+                braces = 0
+            elif block == "{" and braces >= 0:
+                braces += 1
+            elif block == "}" and braces > 0:
+                braces -= 1
+        else:
+            if block == inline or block == "$$":
+                start = i
+                end = block
+                braces = 0
+            elif block[1:6] == "begin":
+                start = i
+                end = "\\end" + block[6:]
+                braces = 0
+            elif block[0] == "`":
+                start = i
+                last = i
+                end = block
+                braces = -1
+            elif block[0] == "\n":
+                if re.search(r'    $', block):
+                    indent = True
+        i += 2
+    if last:
+        process_math(start, last)
+    text = "".join(blocks)
+    if not inline.startswith("\\"):
+        text = re.sub(r'\\\$', '\\\\$', text)
+    return (text, math)
+
+def test_remove_math():
+    def remove_math(s):
+        return print_docs.mistletoe_renderer.remove_math(s, '$')
+    assert remove_math('Let $x^{2}$ be \\$5 and $$\\sum_i x_i$$.') == ('Let @@0@@ be \\$5 and @@1@@.', ['$x^{2}$', '$$\\sum_i x_i$$'])
+    assert remove_math('a `$x$` b') == ('a `$x$` b', [])
+    assert remove_math('\\begin{align}x\\end{align} and $a\n\nb$') == ('@@0@@ and $a\n\nb$', ['\\begin{align}x\\end{align}'])
+    assert remove_math('a\r\n    $x\r\n    y$') == ('a\n    @@0@@', ['$x\ny$'])
+    # unbalanced braces and backticks
+    assert remove_math('${x$ y$\n\nz') == ('@@0@@\n\nz', ['${x$ y$'])
+    assert remove_math('x `` $y$ ``` z\n\n`w') == ('x `` @@0@@ ``` z\n\n@@1@@w', ['$y$', '`'])
+    assert remove_math('lone ` @@3@@') == ('lone @@1@@ @@0@@', ['@@3@@', '`'])
+
+    # math in indented lines, and markers that were already in the text
+    assert remove_math('\n    $\n    $`') == ('\n    @@0@@@@1@@', ['$\n$', '`'])
+    assert remove_math('\n    $$}\n    `$$``') == ('\n    @@0@@@@1@@', ['$$}\n`$$', '``'])
+    assert remove_math('$@@12@@$') == ('@@1@@', ['@@12@@', '$@@0@@$'])
+    assert remove_math('`@@12@@\n') == ('`@@1@@\n', ['@@12@@', '@@0@@'])
+
+    # on random texts, the same as the split and rejoin it replaced
+    pieces = ['$', '$$', '\\$', '\\\\', '\\{', '{', '}', '\\begin{align}', '\\end{align}', '\\begin{X*}', '\\end{X*}',
+              '`', '``', '\n', '\n\n', '    \n', '\n \t\n', 'a', 'x^2 ', '\\']
+    rng = random.Random(0)
+    for _ in range(20000):
+        s = ''.join(rng.choice(pieces + ['\n    ', '@@0@@', '@@12@@', '@@@1@@', '\r\n', '\r']) for _ in range(rng.randint(0, 30)))
+        assert remove_math(s) == remove_math_split(s, '$')
+
+    # and without indented lines and markers, `replace_math` puts back what was removed
+    n_math = 0
+    for _ in range(20000):
+        s = ''.join(rng.choice(pieces) for _ in range(rng.randint(0, 30)))
+        text, math = remove_math(s)
+        assert re.findall('@@([0-9]+)@@', text) == [str(i) for i in range(len(math))]
+        assert print_docs.mistletoe_renderer.replace_math(text, math) == s
+        n_math += bool(math)
+    assert n_math > 5000
+
+def test_highlight_code():
+    renderer = print_docs.markdown_renderer
+    renderer.highlight_code.cache_clear()
+    md = 'a\n```\nexample : 1 = 1 := rfl\n```\n```nope\n$x$\n```\n'
+    html = renderer.render_md(md)
+    assert '<span class="n">rfl</span>' in html and '<code>$x$\n</code>' in html
+    # the same snippets, from the cache
+    assert renderer.render_md(md) == html
+    assert renderer.highlight_code.cache_info().hits == 2
+    assert renderer.lexer('nope') is renderer.lexer('text')
+
+def test_stream_export_json(monkeypatch, tmp_path, capsys):
+    s = json.dumps({
+        'decls': [{'name': 'nat.succ', 'line': 12345, 'type': ['c', 'a', ['n', 'b']]}, 2.5e-3, None],
+        'mod_docs': {'a.lean': [{'line': 1, 'doc': 'x\ny'}]},
+        'notes': [],
+    }, indent=1)
+    for chunk_size in [1, 2, 7, 1 << 20]:
+        parsed = {}
+        for key, value in print_docs.stream_export_json(io.StringIO(s), chunk_size=chunk_size):
+            parsed[key] = list(value) if key == 'decls' else value
+        assert parsed == json.loads(s)
+    for s in ['{}\n', '{"decls": [{"a": 1}], "x": 2}\n  \n']:
+        assert dict((key, list(value) if key == 'decls' else value)
+                    for key, value in print_docs.stream_export_json(io.StringIO(s))) == json.loads(s)
+    # Lean can print errors after the object, as `json.load` the file is then corrupt
+    for s in ['{} x', '{"decls": [{"a": 1}], "x": 2}\nerror: unknown identifier foo\n']:
+        for chunk_size in [1, 1 << 20]:
+            with pytest.raises(json.JSONDecodeError, match='Extra data'):
+                for key, value in print_docs.stream_export_json(io.StringIO(s), chunk_size=chunk_size):
+                    list(value) if key == 'decls' else value
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'export.json').write_text('{"decls": []}\nerror: unknown identifier foo\n')
+    with pytest.raises(json.JSONDecodeError):
+        print_docs.load_json()
+    assert 'error: unknown identifier foo' in capsys.readouterr().out
+
+def test_linkify_markdown(monkeypatch):
+    monkeypatch.setattr(print_docs, 'site_root', '/', raising=False)
+    monkeypatch.setattr(print_docs, 'current_project', 'test')
+    monkeypatch.setattr(print_docs, 'current_filename', 'a.html')
+    monkeypatch.setattr(print_docs, 'global_notes', {'simp lemmas': None})
+    monkeypatch.setattr(print_docs, 'num_backrefs', collections.defaultdict(int))
+    monkeypatch.setattr(print_docs, 'num_notes', collections.defaultdict(int))
+    loc_map = {'nat.succ': types.SimpleNamespace(url='init/core.html')}
+    bib = types.SimpleNamespace(entries={
+        'serre': types.SimpleNamespace(alpha_label='Ser73'),
+        'bourbaki': types.SimpleNamespace(alpha_label='Bou66')})
+    html = ('<p>See Note [simp lemmas].</p>\n<p>[serre], <code>nat.succ [bourbaki]</code> '
+            'and [the <code>nat.succ</code> book][bourbaki], but not [nat.succ].</p>'
+            '<pre><span class="n">nat.succ</span></pre>')
+    # named references are numbered before standalone ones
+    assert print_docs.linkify_markdown(html, loc_map, bib) == (
+        '<p>See <a id="noteref1" href="/notes.html#simp lemmas">Note [simp lemmas]</a>.</p>\n'
+        '<p><a id="backref2" href="/references.html#Ser73">[Ser73]</a>, '
+        '<code><a href="/init/core.html#nat.succ">nat.succ</a> '
+        '<a id="backref3" href="/references.html#Bou66">[Bou66]</a></code> and '
+        '<a id="backref1" href="/references.html#Bou66">the '
+        '<code><a href="/init/core.html#nat.succ">nat.succ</a></code> book</a>, but not [nat.succ].</p>'
+        '<pre><span class="n"><a href="/init/core.html#nat.succ">nat.succ</a></span></pre>')
+    # runs of brackets, where a standalone reference must not swallow a named one
+    for html, linked in [
+        ('[serre]foo[bourbaki][serre]',
+         '<a id="backref2" href="/references.html#Ser73">[Ser73]</a>foo'
+         '<a id="backref1" href="/references.html#Ser73">bourbaki</a>'),
+        ('[[serre]][[nope][serre],', '[[serre]]<a id="backref1" href="/references.html#Ser73">[nope</a>,'),
+        ('][][nope][serre])\\x', '][]<a id="backref1" href="/references.html#Ser73">nope</a>)\\x')]:
+        print_docs.num_backrefs.clear()
+        assert print_docs.linkify_markdown(html, loc_map, bib) == linked
+
+def test_linkify_efmt(monkeypatch):
+    monkeypatch.setattr(print_docs, 'site_root', '/', raising=False)
+    loc_map = {'nat': types.SimpleNamespace(url='init/data/nat.html')}
+    nat = '\ue000nat\ue001ℕ\ue002'
+    arrow = ['c', ['n', nat], ' →\n']
+    interned = {}
+    f = print_docs.intern_efmt(['c', json.loads(json.dumps(arrow)), ['n', ['c', arrow, ['n', nat]]]], interned)
+    assert f[1] == ('c', ('n', nat), ' →\n') and f[1] is f[2][1][1]
+    rendered = {}
+    html = ('<span class="fn"><span class="fn"><a href="/init/data/nat.html#nat" title="nat">ℕ</a></span> → '
+            '<span class="fn"><span class="fn"><a href="/init/data/nat.html#nat" title="nat">ℕ</a></span> → '
+            '<span class="fn"><a href="/init/data/nat.html#nat" title="nat">ℕ</a></span></span></span>')
+    assert print_docs.linkify_efmt(f, loc_map, rendered) == html
+    assert print_docs.linkify_efmt(f, loc_map, rendered) == html
+    # deeper than the recursion limit
+    deep = 'x'
+    for _ in range(2 * sys.getrecursionlimit()):
+        deep = ['n', ['c', deep, ' ']]
+    html = print_docs.linkify_efmt(print_docs.intern_efmt(deep, interned), loc_map)
+    assert html.startswith('<span class="fn">' * 3) and html.count('</span>') == html.count('<span')
+
+def test_decl(monkeypatch):
+    config = print_docs.Config()
+    config.path_info = [(Path('/mathlib/src'), 'mathlib')]
+    monkeypatch.setattr(print_docs, 'config', config)
+    print_docs.ImportName.of.cache_clear()
+    nat = 'natℕ'
+    def decl(name):
+        return json.loads(json.dumps({
+            'name': name, 'is_meta': False, 'args': [{'arg': ['n', nat], 'implicit': True}], 'type': ['c', nat, ' → Prop'],
+            'doc_string': 'A predicate.', 'filename': '/mathlib/src/data/nat/basic.lean', 'line': 3, 'attributes': ['simp'],
+            'noncomputable_reason': None, 'sorried': False, 'equations': [], 'kind': 'structure',
+            'structure_fields': [[name + '.x', nat]], 'constructors': [], 'extra': 1}))
+    interned = {}
+    a, b = print_docs.Decl(decl('p'), interned), print_docs.Decl(decl('q'), interned)
+    print_docs.ImportName.of.cache_clear()
+    # read as attributes and as items
+    assert a.name == a['name'] == 'p' and a.filename.name == 'data.nat.basic' and a['structure_fields'] == (('p.x', nat),)
+    assert 'name' in a and 'doc' not in a and 'extra' not in a
+    # shared with the other declarations
+    assert a.args is not b.args and a.args[0] is b.args[0] and a.args[0].implicit
+    assert a.attributes is b.attributes and a.doc_string is b.doc_string and a.type is b.type
+    assert a.as_dict()['constructors'] == () and list(a.as_dict()) == list(print_docs.decl_fields)
+    file_map, loc_map, decl_map, owner_map = print_docs.separate_results([a, b])
+    assert loc_map['p.mk'] == a.filename and owner_map[a.filename]['q.x'] is b
+
+def test_trace_deps_cache(monkeypatch, tmp_path):
+    config = print_docs.Config()
+    config.lean_commit = 'abc'
+    config.lean_path = [str(tmp_path)]
+    monkeypatch.setattr(print_docs, 'config', config)
+    imports = {'a': ['b'], 'b': [], 'c': ['a', 'b']}
+    calls = []
+    def lean_deps(path):
+        calls.append(path.stem if path.stem != 'default' else path.parent.name)
+        return [str(paths[name].with_suffix('.olean')) for name in imports[calls[-1]]]
+    monkeypatch.setattr(print_docs, 'lean_deps', lean_deps)
+    paths = {}
+    def write(name, path, source = ''):
+        paths[name] = tmp_path / path
+        paths[name].parent.mkdir(exist_ok=True)
+        paths[name].write_text(source)
+    def run():
+        calls.clear()
+        file_map = {print_docs.ImportName('p', (name,), path): [] for name, path in paths.items()}
+        graph = print_docs.trace_deps(file_map, cache_dir=str(tmp_path / 'cache'))
+        return sorted(calls), sorted((a.raw_path.relative_to(tmp_path).as_posix(), b.raw_path.relative_to(tmp_path).as_posix())
+                                     for a, b in graph.edges)
+    for name in imports:
+        write(name, f'{name}.lean')
+    edges = [('a.lean', 'b.lean'), ('c.lean', 'a.lean'), ('c.lean', 'b.lean')]
+    assert run() == (['a', 'b', 'c'], edges)
+    assert run() == ([], edges)
+    write('a', 'a.lean', 'import b')
+    assert run() == (['a'], edges)
+    # `b.lean` becomes `b/default.lean`: the files that imported it are traced again
+    (tmp_path / 'b.lean').unlink()
+    write('b', 'b/default.lean')
+    assert run() == (['a', 'b', 'c'], [('a.lean', 'b/default.lean'), ('c.lean', 'a.lean'), ('c.lean', 'b/default.lean')])
+    assert run()[0] == []
+    # another Lean installation
+    config.lean_commit = 'def'
+    assert run()[0] == ['a', 'b', 'c']
+    config.lean_path = [str(tmp_path), str(tmp_path / 'b')]
+    assert run()[0] == ['a', 'b', 'c']
+    assert run()[0] == []
+    # a new file can change which file an import resolves to
+    (tmp_path / 'b.lean').write_text('')
+    assert run()[0] == ['a', 'b', 'c']
+    assert run()[0] == []
+    # without a cache, the files are not read
+    file_map = {print_docs.ImportName('p', ('d',), tmp_path / 'd.lean'): []}
+    imports['d'] = []
+    assert list(print_docs.trace_deps(file_map).nodes) == list(file_map)
+
+def test_mk_site_tree_core():
+    filenames = [['mathlib', 'data', 'nat', 'basic'], ['mathlib', 'data', 'nat'], ['core', 'init', 'core'],
+                 ['mathlib', 'algebra', 'group']]
+    file = lambda name, path: {'kind': 'file', 'name': name, 'path': path}
+    assert print_docs.mk_site_tree_core(filenames) == [
+        {'kind': 'project', 'name': 'core', 'path': '', 'children': [
+            {'kind': 'dir', 'name': 'init', 'path': 'init', 'children': [file('core', 'init/core.html')]}]},
+        {'kind': 'project', 'name': 'mathlib', 'path': '', 'children': [
+            {'kind': 'dir', 'name': 'algebra', 'path': 'algebra', 'children': [file('group', 'algebra/group.html')]},
+            {'kind': 'dir', 'name': 'data', 'path': 'data', 'children': [
+                {'kind': 'dir', 'name': 'nat', 'path': 'data/nat', 'children': [file('basic', 'data/nat/basic.html')]},
+                file('nat', 'data/nat.html')]}]}]
+
+    # a synthetic library of 50k modules, 50 per directory
+    filenames = [['mathlib', f'd{i % 10}', f'd{i // 10 % 100}', f'file{i}'] for i in range(50000)]
+    tree = print_docs.mk_site_tree_core(filenames)
+    paths = []
+    todo = list(tree)
+    while todo:
+        entry = todo.pop()
+        todo.extend(entry.get('children', []))
+        if entry['kind'] == 'file':
+            paths.append(entry['path'])
+    assert sorted(paths) == sorted('/'.join(filename[1:]) + '.html' for filename in filenames)
+
+def test_write_search_index(monkeypatch, tmp_path):
+    monkeypatch.setattr(print_docs, 'html_root', str(tmp_path) + '/', raising=False)
+    doc = 'The successor of a natural number.'
+    print_docs.write_search_index([
+        {'name': 'nat.succ', 'description': doc, 'p': 'core'},
+        {'name': 'nat.succ_ne_zero', 'description': 'The successor is not `0`.', 'p': 'mathlib'},
+        {'name': 'nat.succ.inj', 'description': doc, 'p': 'core'}])
+    index = tmp_path / 'search_index'
+    assert json.loads((index / 'names.json').read_text()) == {
+        'projects': ['core', 'mathlib'], 'names': ['nat.succ', 'nat.succ_ne_zero', 'nat.succ.inj'], 'p': [0, 1, 0]}
+    shard = json.loads((index / f'{print_docs.search_shard("successor")}.json').read_text())
+    assert shard['successor'] == [0, 1, 2]
+    assert json.loads((index / f'{print_docs.search_shard("natural")}.json').read_text())['natural'] == [0, 2]
+    assert len(list(index.iterdir())) == print_docs.search_shard_count + 1
+
+    # words are matched as the start of a word of the docstring, other parts as substrings of it
+    searchable_data = [{'name': 'a.b', 'description': doc, 'p': 'core'},
+                       {'name': 'c.d', 'description': 'The successor is not `0`.', 'p': 'core'},
+                       {'name': 'e.f', 'description': 'The map x ↦ x+1 on strings.', 'p': 'core'}]
+    print_docs.write_search_index(searchable_data)
+    names = (index / 'names.json').read_text()
+    shards = [json.loads((index / f'{n}.json').read_text()) for n in range(print_docs.search_shard_count)]
+    queries = ['natural num', 'succ', 'ring', 'x+1 on', '`0` successor', 'is 0', 'i', 'map 2']
+    if shutil.which('node'):
+        index_js = (f'({{decls: loadDecls({names}), loadDocShard: async (n) => {json.dumps(shards)}[n], '
+                    f'loadDocs: async () => loadDocstrings({json.dumps(searchable_data)})}})')
+        matches = eval_js(['search.js'], f'Promise.all({json.dumps(queries)}.map((q) => getMatches({index_js}, q)))')
+        assert [[match['decl'] for match in results] for results in matches] == [
+            ['a.b'], ['a.b', 'c.d'], [], ['e.f'], ['c.d'], ['c.d'], [], []]
+
+def test_search_shard():
+    # words starting with a character outside the BMP, which is two UTF-16 code units in search.js
+    shards = {'natural': 48, 'εδ': 44, '𝕜₁': 63, '𝓝': 55, '𝔽_p': 24}
+    assert {word: print_docs.search_shard(word) for word in shards} == shards
+    if shutil.which('node'):
+        assert eval_js(['search.js'], f'{json.dumps(list(shards))}.map(searchShard)') == list(shards.values())
+
+def test_find_shard():
+    shards = {'nat.succ': 124, 'is_o': 195, 'filter.tendsto_𝓝': 237, 'ℝ≥0∞': 33}
+    assert {name: print_docs.find_shard(name) for name in shards} == shards
+    if shutil.which('node'):
+        assert eval_js(['search.js', 'find.js'], f'{json.dumps(list(shards))}.map(findShard)') == list(shards.values())
+
+def test_write_export_db(monkeypatch, tmp_path):
+    monkeypatch.setattr(print_docs, 'html_root', str(tmp_path) + '/', raising=False)
+    core = types.SimpleNamespace(project='core', url='init/core.html')
+    nat = types.SimpleNamespace(project='mathlib', url='data/nat/basic.html')
+    entries = [(core, 'eq', {'kind': 'inductive'}), (core, 'eq.refl', {'args': []}),
+               (nat, 'nat.succ_le', {'line': 3, 'type': 'natℕ'})]
+    print_docs.write_export_db(iter(entries), shard_by='module', compresslevel=1)
+    read = lambda path: gzip.decompress((tmp_path / path).read_bytes()).decode('utf-8')
+    assert read('export_db.json.gz') == json.dumps({name: entry for _, name, entry in entries})
+    assert json.loads(read('export_db/core/init/core.json.gz')) == dict((name, entry) for _, name, entry in entries[:2])
+    assert json.loads(read('export_db/mathlib/data/nat/basic.json.gz')) == {'nat.succ_le': entries[2][2]}
+    print_docs.write_export_db(iter([]), shard_by='project')
+    assert read('export_db.json.gz') == '{}'
+
+    # a structure field that is also a declaration keeps its first place, but gets its last entry, as in a dict
+    config = print_docs.Config()
+    config.library_link_roots = {'test': 'https://example.com/'}
+    monkeypatch.setattr(print_docs, 'config', config)
+    monkeypatch.setattr(print_docs, 'site_root', '/', raising=False)
+    monkeypatch.setattr(print_docs, 'decl_headers', {'foo': '<foo>', 'foo.x': '<foo.x>'})
+    foo = print_docs.ImportName('test', ('foo',), Path('/src/foo.lean'))
+    def decl(name, kind, line, **fields):
+        return {'name': name, 'filename': foo, 'kind': kind, 'is_meta': False, 'line': line, 'args': [], 'type': 'ℕ',
+                'constructors': [], 'structure_fields': [], **fields}
+    structure = decl('foo', 'structure', 1, constructors=[('foo.mk', 'ℕ')], structure_fields=[('foo.x', 'ℕ')])
+    for decls in [[structure, decl('foo.x', 'def', 2)], [decl('foo.x', 'def', 2), structure]]:
+        old = {}
+        for obj in decls:
+            old[obj['name']] = print_docs.mk_export_map_entry(obj['name'], foo, obj['kind'], False, obj['line'], [], 'ℕ')
+            old[obj['name']]['decl_header_html'] = '<' + obj['name'] + '>'
+            for name, tp in obj['constructors'] + obj['structure_fields']:
+                old[name] = print_docs.mk_export_map_entry(name, foo, obj['kind'], False, obj['line'], [], tp)
+        print_docs.write_export_db(print_docs.mk_export_db({foo: decls}), shard_by='module')
+        assert read('export_db.json.gz') == json.dumps(old)
+        assert read('export_db/test/foo.json.gz') == json.dumps(old)
+
+def render_in_worker(ds):
+    # as `write_module_page_in_worker`
+    html = print_docs.markdown_cache.render(ds, str.upper)
+    print_docs.markdown_cache.flush()
+    return html, os.getpid()
+
+def test_markdown_cache(monkeypatch, tmp_path):
+    path = str(tmp_path / 'cache' / 'markdown.sqlite')
+    rendered = []
+    def render_md(ds):
+        rendered.append(ds)
+        return ds.upper()
+    def run(docs, stamp, max_bytes = 1 << 20):
+        rendered.clear()
+        cache = print_docs.MarkdownCache(path, max_bytes)
+        cache.stamp = stamp
+        assert [cache.render(ds, render_md) for ds in docs] == [ds.upper() for ds in docs]
+        cache.close()
+        return cache.hits, cache.misses, rendered[:]
+    assert run(['a', 'b'], 1) == (0, 2, ['a', 'b'])
+    assert run(['a', 'b', 'c'], 2) == (2, 1, ['c'])
+    # `a` and `c` were used last, and only two entries fit
+    assert run(['a', 'c'], 3, max_bytes = 2) == (2, 0, [])
+    assert run(['b', 'a', 'c'], 4) == (2, 1, ['b'])
+    # flushed entries are seen before `close`
+    cache = print_docs.MarkdownCache(path, 1 << 20)
+    cache.render('d', render_md)
+    cache.flush()
+    assert run(['d'], 5) == (1, 0, [])
+    cache.close()
+    # another version of the renderer
+    monkeypatch.setattr(print_docs, 'markdown_renderer_version', lambda: 'other')
+    assert run(['a', 'd'], 6) == (0, 2, ['a', 'd'])
+
+    # forked workers open their own connection, and do not write what the parent had not yet flushed
+    cache = print_docs.MarkdownCache(path, 1 << 20)
+    monkeypatch.setattr(print_docs, 'markdown_cache', cache)
+    cache.render('e', render_md)
+    cache.disconnect()
+    assert cache.new_entries == [] and cache.conn is None
+    with multiprocessing.get_context('fork').Pool(2) as pool:
+        results = pool.map(render_in_worker, ['f', 'g', 'h'], chunksize = 1)
+    assert [html for html, _ in results] == ['F', 'G', 'H'] and os.getpid() not in {pid for _, pid in results}
+    cache.close()
+    assert run(['e', 'f', 'g', 'h'], 7) == (4, 0, [])
+
+def test_write_module_pages_jobs(monkeypatch, tmp_path):
+    spec = importlib.util.spec_from_file_location('synthetic_export', Path(__file__).parent.parent / 'bench' / 'synthetic_export.py')
+    synthetic_export = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(synthetic_export)
+    config = print_docs.Config()
+    config.path_info = [(synthetic_export.core_root, 'core'), (synthetic_export.mathlib_root, 'mathlib')]
+    config.lean_commit = 'abc'
+    config.mathlib_commit = 'def'
+    config.mathlib_github_root = 'https://github.com/leanprover-community/mathlib'
+    monkeypatch.setattr(print_docs, 'config', config)
+    monkeypatch.setattr(print_docs, 'site_root', '/', raising=False)
+    monkeypatch.setattr(print_docs, 'markdown_cache', None)
+    print_docs.ImportName.of.cache_clear()
+    data = synthetic_export.synthetic_export(modules = 12, decls = 4)
+    interned = {}
+    file_map, loc_map, _, _ = print_docs.separate_results(print_docs.Decl(decl, interned) for decl in data['decls'])
+    mod_docs = {print_docs.ImportName.of(f): docs for f, docs in data['mod_docs'].items()}
+    for i_name in mod_docs:
+        file_map[i_name]
+    import_graph = nx.DiGraph()
+    modules = list(file_map)
+    import_graph.add_nodes_from(modules)
+    import_graph.add_edges_from(zip(modules[1:], modules))
+    bib_file = tmp_path / 'references.bib'
+    bib_file.write_text(''.join(f'@Book{{{key}, author = {{Author}}, title = {{{key}}}, year = {{1970}}}}\n'
+                                for key in synthetic_export.references))
+
+    def run(jobs, incremental):
+        out = tmp_path / f'out_{jobs}_{incremental}'
+        monkeypatch.setattr(print_docs, 'html_root', f'{out}/', raising=False)
+        monkeypatch.setattr(print_docs, 'output_log', {})
+        monkeypatch.setattr(print_docs, 'decl_headers', {})
+        monkeypatch.setattr(print_docs, 'num_notes', collections.defaultdict(int))
+        monkeypatch.setattr(print_docs, 'num_backrefs', collections.defaultdict(int))
+        monkeypatch.setattr(print_docs, 'global_notes', {name: print_docs.GlobalNote(md, []) for name, md in data['notes']})
+        bib = print_docs.parse_bib_file(str(bib_file))
+        build = print_docs.IncrementalBuild(str(out / 'incremental.json'), data['notes'], bib, loc_map) if incremental else None
+        print_docs.setup_jinja_globals(file_map, loc_map, data['instances'], data['instances_for'], bib,
+                                       log_links = incremental, import_graph = import_graph)
+        print_docs.write_module_pages(file_map, mod_docs, bib, jobs, build)
+        files = {path.relative_to(out).as_posix(): path.read_bytes() for path in out.rglob('*') if path.is_file()}
+        backrefs = ([(name, note.backrefs) for name, note in print_docs.global_notes.items()],
+                    [(key, entry.backrefs) for key, entry in bib.entries.items()])
+        pages = build and [(url, page['inputs'], sorted(page['links']), page['backrefs']) for url, page in build.pages.items()]
+        counts = [{url: n for url, n in num.items() if n} for num in [print_docs.num_notes, print_docs.num_backrefs]]
+        return files, backrefs, *counts, print_docs.decl_headers, pages
+
+    files, backrefs, *_ = serial = run(1, False)
+    assert len(files) == len(file_map)
+    assert all(note_backrefs for _, note_backrefs in backrefs[0]) and any(bib_backrefs for _, bib_backrefs in backrefs[1])
+    # the backrefs are replayed in the order of the modules, and the link logs kept for each page
+    assert run(2, False) == serial
+    # the caches shared by the filters are dropped between pages once they are too large
+    monkeypatch.setattr(print_docs, 'filter_cache_entries', dict.fromkeys(print_docs.filter_cache_entries, 1))
+    assert run(1, False) == serial
+    logged = run(1, True)
+    assert logged[:5] == serial[:5] and len(logged[5]) == len(file_map)
+    assert run(3, True) == logged
+    print_docs.ImportName.of.cache_clear()
+
+def test_incremental_build(monkeypatch, tmp_path):
+    monkeypatch.setattr(print_docs, 'html_root', str(tmp_path) + '/', raising=False)
+    monkeypatch.setattr(print_docs, 'site_root', '/', raising=False)
+    config = print_docs.Config()
+    config.lean_commit = 'abc'
+    config.mathlib_github_root = 'https://github.com/leanprover-community/mathlib'
+    monkeypatch.setattr(print_docs, 'config', config)
+    bib = types.SimpleNamespace(entries={})
+    a = types.SimpleNamespace(url='a.html')
+    b = types.SimpleNamespace(url='b.html')
+    (tmp_path / 'a.html').write_text('')
+    manifest = str(tmp_path / 'cache' / 'incremental.json')
+    backrefs = [['note', 'simp lemmas', ['a.html', 'noteref1', 'p: a']]]
+    build = print_docs.IncrementalBuild(manifest, [], bib, {'x': a, 'y': b})
+    assert build.fresh_page(a, 'inputs') is None
+    build.add_page(a, 'inputs', {'x', 'z', ' '}, backrefs)
+    build.save()
+
+    # `a` did not look up `y`
+    build = print_docs.IncrementalBuild(manifest, [], bib, {'x': a, 'y': a})
+    assert build.fresh_page(a, 'inputs') == backrefs
+    assert build.fresh_page(a, 'other inputs') is None
+    # `a` looked up `z` before it existed
+    build = print_docs.IncrementalBuild(manifest, [], bib, {'x': a, 'y': b, 'z': b})
+    assert build.fresh_page(a, 'inputs') is None
+    # the notes changed
+    build = print_docs.IncrementalBuild(manifest, [('simp lemmas', '')], bib, {'x': a, 'y': b})
+    assert build.fresh_page(a, 'inputs') is None
+
+def test_config(monkeypatch, tmp_path):
+    config = print_docs.Config()
+    monkeypatch.setattr(print_docs, 'config', config)
+    (tmp_path / 'config.json').write_text(json.dumps({
+        'mathlib_commit': 'def', 'mathlib_github_root': 'https://github.com/leanprover-community/mathlib',
+        'lean_commit': 'abc', 'lean_path': ['/lean/library', '/mathlib/src'], 'docgen_commit': 'ghi'}))
+    # values set before loading are kept
+    config.docgen_commit = 'jkl'
+    config.path_info = [(Path('/lean/library'), 'core'), (Path('/mathlib/src'), 'mathlib')]
+    config.load(tmp_path / 'config.json')
+    assert config.docgen_commit == 'jkl'
+    assert config.url_rewrites[0] == [
+        'https://github.com/leanprover-community/mathlib/blob/master/src/',
+        'https://github.com/leanprover-community/mathlib/blob/def/src/']
+    assert config.library_link_roots['core'] == 'https://github.com/leanprover-community/lean/blob/abc/library/'
+    print_docs.ImportName.of.cache_clear()
+    assert print_docs.ImportName.of('/mathlib/src/data/nat/basic.lean').name == 'data.nat.basic'
+    print_docs.ImportName.of.cache_clear()
+
+    config.save(tmp_path / 'saved.json')
+    saved = json.loads((tmp_path / 'saved.json').read_text())
+    assert saved['lean_path'] == ['/lean/library', '/mathlib/src']
+    assert saved['docgen_commit'] == 'jkl'
+
+def test_write_outfile(monkeypatch, tmp_path):
+    monkeypatch.setattr(print_docs, 'html_root', str(tmp_path) + '/', raising=False)
+    monkeypatch.setattr(print_docs, 'output_log', {})
+    (tmp_path / 'same.html').write_text('same')
+    (tmp_path / 'old').mkdir()
+    (tmp_path / 'old' / 'module.html').write_text('old')
+    (tmp_path / '.nojekyll').write_text('')
+    with print_docs.open_outfile('same.html') as out:
+        out.write('same')
+    with print_docs.open_outfile('new/page.html') as out:
+        out.write('new')
+    print_docs.write_outfile(str(tmp_path / 'same.html'), b'same')
+    print_docs.write_outfile('index.html', 'ä'.encode('utf-8'))
+    assert print_docs.finish_output() == {
+        'added': ['index.html', 'new/page.html'], 'changed': [], 'removed': ['old/module.html']}
+    assert (tmp_path / 'index.html').read_text(encoding='utf-8') == 'ä'
+
+    print_docs.output_log.clear()
+    print_docs.keep_outfile('index.html')
+    print_docs.write_outfile('new/page.html', b'changed')
+    assert print_docs.finish_output(clean=True) == {
+        'added': [], 'changed': ['new/page.html'], 'removed': ['old/module.html', 'same.html']}
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['.nojekyll', 'index.html', 'new']
+
+    # binary files go through a temporary file, compared in chunks with the old one
+    print_docs.output_log.clear()
+    (tmp_path / 'target.gz').write_bytes(b'target')
+    os.symlink('target.gz', tmp_path / 'link.gz')
+    for name, data in [('db.gz', b'db' * 10), ('index.html', 'ä'.encode('utf-8')), ('link.gz', b'target')]:
+        with print_docs.open_outfile(name, 'wb') as out:
+            out.write(data)
+    with pytest.raises(ValueError):
+        with print_docs.open_outfile('broken.gz', 'wb') as out:
+            out.write(b'partial')
+            raise ValueError
+    assert print_docs.output_log == {'db.gz': 'added', 'index.html': 'unchanged', 'link.gz': 'changed'}
+    assert not (tmp_path / 'link.gz').is_symlink() and (tmp_path / 'target.gz').read_bytes() == b'target'
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['.nojekyll', 'db.gz', 'index.html', 'link.gz', 'new', 'target.gz']
+    assert print_docs.same_file_contents(tmp_path / 'db.gz', tmp_path / 'db.gz', chunk_size=3)
+    (tmp_path / 'other.gz').write_bytes(b'db' * 9 + b'dc')
+    assert not print_docs.same_file_contents(tmp_path / 'db.gz', tmp_path / 'other.gz', chunk_size=3)
+
+def test_profiler(monkeypatch):
+    profiler = print_docs.Profiler()
+    monkeypatch.setattr(print_docs, 'profiler', profiler)
+    with print_docs.phase('write_html_files'):
+        with print_docs.phase('write_module_pages'):
+            profiler.pages += [(0.5, 'a.html'), (2.0, 'b.html'), (1.0, 'c.html')]
+            assert print_docs.render_template('library_nav.j2', site_tree=[]) == ''
+    # a worker process
+    worker = print_docs.Profiler()
+    worker.add_template('module.j2', 1.5)
+    worker.pages.append((1.5, 'd.html'))
+    profiler.merge_pages(worker.take_pages())
+    assert worker.take_pages() == ({}, [])
+
+    report = json.loads(json.dumps(profiler.report(2)))
+    assert [p['phase'] for p in report['phases']] == ['write_html_files/write_module_pages', 'write_html_files']
+    assert all(p['wall'] >= 0 and p['cpu'] >= 0 and p['max_rss_mb'] > 0 for p in report['phases'])
+    assert list(report['templates']) == ['module.j2', 'library_nav.j2']
+    assert report['templates']['library_nav.j2']['count'] == 1
+    assert report['module_pages']['count'] == 4
+    assert report['slowest_module_pages'] == [{'page': 'b.html', 'seconds': 2.0}, {'page': 'd.html', 'seconds': 1.5}]
+
+    # without `resource`, as on Windows
+    monkeypatch.setitem(sys.modules, 'resource', None)
+    assert print_docs.max_rss_mb() is None and print_docs.max_rss_mb(children=True) is None